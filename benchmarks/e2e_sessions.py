@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark of planning sessions.
+
+Runs the real Application (telegram_bot.build_application) against the fake Telegram and
+Calendar servers, and drives complete /start -> confirm sessions through the ConversationHandler.
+Reports per-step latency (update queued -> the bot's reply arrives), outbound calls per session
+and the total confirm time (confirm press -> result message, with the calendar written).
+
+    python benchmarks/e2e_sessions.py --sessions 20 --calendar-latency-ms 80 --telegram-latency-ms 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_calendar_server import FakeCalendarServer  # noqa: E402
+from fake_telegram_server import FakeTelegramServer  # noqa: E402
+from latency_stats import percentile  # noqa: E402
+
+USER_ID = 424242
+RESULT_PREFIXES = ("✅", "⚠️", "❌")
+
+
+class SessionDriver:
+    """Plays one user through the conversation, one update at a time."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, app, telegram, user_id, single_message_flow):
+        self.app = app
+        self.telegram = telegram
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': "Bench"}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.single_message_flow = single_message_flow
+        self.message = None  # the bot message whose buttons are pressed next
+        self.timings = {}
+
+    async def _send(self, payload, step, expect):
+        """Queues an update and waits for the call that completes the step."""
+        from telegram import Update
+        since = len(self.telegram.calls)
+        started = time.perf_counter()
+        await self.app.update_queue.put(Update.de_json(dict(payload, update_id=next(self._update_ids)),
+                                                       self.app.bot))
+        call = await self.telegram.wait_for(expect, since)
+        self.timings[step] = (call.received_at - started) * 1000
+        return call
+
+    def _is_chat(self, call):
+        return str(call.params.get('chat_id')) == str(self.chat['id'])
+
+    async def command(self, text, step):
+        message = {'message_id': next(self._update_ids), 'date': int(time.time()), 'chat': self.chat,
+                   'from': self.user, 'text': text,
+                   'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]}
+        call = await self._send({'message': message}, step,
+                                lambda c: c.method == 'sendMessage' and self._is_chat(c))
+        self.message = call.result
+
+    async def press(self, data, step, expect=None):
+        query = {'id': str(next(self._update_ids)), 'from': self.user, 'chat_instance': "bench",
+                 'data': data, 'message': self.message}
+        call = await self._send({'callback_query': query}, step, expect or self._advanced)
+        if isinstance(call.result, dict):
+            self.message = call.result
+        return call
+
+    def _advanced(self, call):
+        """The call that shows the next step of the wizard."""
+        if not self._is_chat(call):
+            return False
+        if self.single_message_flow:
+            return call.method == 'editMessageText' and 'reply_markup' in call.params
+        return call.method == 'sendMessage'
+
+    def _markup_edited(self, call):
+        return call.method == 'editMessageReplyMarkup' and self._is_chat(call)
+
+    async def run(self, session, confirm, cfg):
+        day = session % 6
+        await self.command("/start", "start")
+        await self.press(f"{cfg.PREFIX_PICKUP}{day}", "pickup_toggle", self._markup_edited)
+        await self.press(f"{cfg.PREFIX_PICKUP}{cfg.ACTION_DONE}", "pickup_done")
+        await self.press(f"{cfg.PREFIX_DATE_HILA}{day}", "date_a")
+        await self.press(f"{cfg.PREFIX_DATE_ALON}{(day + 1) % 7}", "date_b")
+        await self.press(f"{cfg.PREFIX_KIMEL}{(day + 2) % 6}", "kimel_toggle", self._markup_edited)
+        await self.press(f"{cfg.PREFIX_KIMEL}{cfg.ACTION_DONE}", "summary")
+
+        started = time.perf_counter()
+        await self.press(confirm, "confirm_ack",
+                         lambda c: c.method == 'editMessageText' and self._is_chat(c) and c.text.startswith("📥"))
+        since = len(self.telegram.calls)
+        result = await self.telegram.wait_for(
+            lambda c: c.method == 'sendMessage' and self._is_chat(c) and c.text.startswith(RESULT_PREFIXES), since)
+        self.timings['confirm_total'] = (result.received_at - started) * 1000
+        return result.text
+
+
+def configure_environment(args, calendar, telegram):
+    """The bot reads its configuration at import - set it before importing telegram_bot."""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': "123456:BENCHMARK",
+        'ADMIN_CHAT_ID': str(USER_ID),
+        'CALENDAR_ID': "bench@group.calendar.google.com",
+        'GOOGLE_API_ENDPOINT': calendar.url,
+        'TELEGRAM_API_URL': telegram.url,
+        'CALENDAR_BACKEND': args.backend,
+        'SINGLE_MESSAGE_FLOW': "1" if args.single_message_flow else "0",
+        'PICKUP_MODE': args.pickup_mode,
+        'COMMIT_MODE': args.commit_mode,
+        'CALENDAR_WARMUP_DELAY': "0",
+        'TENANTS_FILE': "",
+    })
+
+
+async def run_benchmark(args, calendar, telegram):
+    import config as cfg
+    import telegram_bot
+    from webhook_server import UpdateLatency
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    confirm = {'single': cfg.ACTION_CONFIRM, 'bulk': cfg.ACTION_BULK_COPY}[args.confirm]
+    app = telegram_bot.build_application(UpdateLatency())
+    telegram.attach(asyncio.get_running_loop())
+
+    steps = defaultdict(list)
+    telegram_calls = Counter()
+    calendar_calls = Counter()
+    async with app:
+        await app.start()
+        for session in range(args.warmup + args.sessions):
+            telegram_since = len(telegram.calls)
+            calendar_before = Counter(calendar.stats())
+            driver = SessionDriver(app, telegram, USER_ID, args.single_message_flow)
+            result = await driver.run(session, confirm, cfg)
+            if session < args.warmup:
+                continue
+            for step, ms in driver.timings.items():
+                steps[step].append(ms)
+            telegram_calls.update(telegram.counts(telegram_since))
+            calendar_calls.update(Counter(calendar.stats()) - calendar_before)
+            if args.verbose:
+                print(f"session {session}: {result.splitlines()[0]} | "
+                      + " ".join(f"{k}={v:.0f}" for k, v in driver.timings.items()))
+        await app.stop()
+
+    return {
+        'sessions': args.sessions,
+        'steps_ms': {step: {'p50': round(percentile(v, 0.5), 1), 'p99': round(percentile(v, 0.99), 1),
+                            'max': round(max(v), 1)} for step, v in steps.items()},
+        'telegram_calls_per_session': {m: round(n / args.sessions, 2) for m, n in sorted(telegram_calls.items())},
+        'calendar_calls_per_session': {m: round(n / args.sessions, 2) for m, n in sorted(calendar_calls.items())},
+    }
+
+
+def print_report(report, args):
+    print(f"\n{report['sessions']} sessions | calendar latency {args.calendar_latency_ms} ms | "
+          f"telegram latency {args.telegram_latency_ms} ms | backend {args.backend} | confirm {args.confirm}")
+    print(f"\n{'step':<16}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, s in report['steps_ms'].items():
+        print(f"{step:<16}{s['p50']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+    print("\nTelegram calls per session: "
+          + ", ".join(f"{m} {n}" for m, n in report['telegram_calls_per_session'].items()))
+    print("Calendar calls per session: "
+          + ", ".join(f"{m} {n}" for m, n in report['calendar_calls_per_session'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1, help="sessions run first and left out of the report")
+    parser.add_argument('--calendar-latency-ms', type=float, default=50)
+    parser.add_argument('--calendar-item-ms', type=float, default=2, help="per request inside a batch")
+    parser.add_argument('--telegram-latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0, help="share of Calendar requests failing with 403")
+    parser.add_argument('--confirm', choices=('single', 'bulk'), default='single')
+    parser.add_argument('--backend', choices=('google', 'ics', 'memory'), default='google')
+    parser.add_argument('--pickup-mode', choices=('single', 'recurring'), default='single')
+    parser.add_argument('--commit-mode', choices=('best_effort', 'atomic'), default='best_effort')
+    parser.add_argument('--single-message-flow', action='store_true')
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    calendar = FakeCalendarServer(latency_ms=args.calendar_latency_ms, item_ms=args.calendar_item_ms,
+                                  error_rate=args.error_rate).start()
+    telegram = FakeTelegramServer(latency_ms=args.telegram_latency_ms).start()
+    configure_environment(args, calendar, telegram)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    with tempfile.TemporaryDirectory(prefix="hilalon-bench-") as workdir:
+        os.chdir(workdir)  # the bot's SQLite files, exports and tokens stay out of the repository
+        report = asyncio.run(run_benchmark(args, calendar, telegram))
+
+    calendar.stop()
+    telegram.stop()
+    print_report(report, args)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
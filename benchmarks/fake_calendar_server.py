@@ -0,0 +1,366 @@
+"""
+A local stand-in of the Google Calendar v3 API, for benchmarks.
+
+Serves the calls the bot makes - events list (time range, private property filter,
+showDeleted, sync tokens), insert, patch, delete and the batch endpoint - from memory,
+with configurable latency and injected quota errors. Weekly RRULE series are expanded
+into instances with Google's instance IDs.
+
+Point the bot at it with GOOGLE_API_ENDPOINT=http://127.0.0.1:<port>/ (no token needed).
+
+    python benchmarks/fake_calendar_server.py --port 8081 --latency-ms 80 --error-rate 0.05
+"""
+import argparse
+import copy
+import datetime
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zoneinfo import ZoneInfo
+
+UTC = datetime.timezone.utc
+SERIES_WEEKS = 26  # instances generated for a weekly series
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+
+
+def _instant(when):
+    dt = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt
+
+
+class ApiError(Exception):
+    def __init__(self, status, reason, message):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+    def body(self):
+        return {'error': {'code': self.status, 'message': str(self),
+                          'errors': [{'domain': 'global', 'reason': self.reason, 'message': str(self)}]}}
+
+
+class FakeCalendar:
+    """The calendars (calendar ID -> event ID -> event) and the API semantics the bot relies on."""
+
+    def __init__(self, error_rate=0.0, error_status=403):
+        self.calendars = {}
+        self.changes = []  # (calendar ID, event ID), in order - sync tokens are positions in it
+        self.truncated = set()  # instances cancelled because their series got an UNTIL
+        self.token_epoch = uuid.uuid4().hex[:8]
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def invalidate_sync_tokens(self):
+        """Every sync token handed out so far now gets 410 Gone (forces a full resync)."""
+        with self._lock:
+            self.token_epoch = uuid.uuid4().hex[:8]
+
+    def reset(self):
+        with self._lock:
+            self.calendars.clear()
+            self.changes.clear()
+            self.truncated.clear()
+            self.stats.clear()
+
+    # --- Requests ---
+
+    def handle(self, method, path, query, body):
+        """One API request. Returns (status, response body or None)."""
+        try:
+            self._maybe_fail()
+            with self._lock:
+                return self._dispatch(method, path, query, body)
+        except ApiError as e:
+            self.stats['errors'] += 1
+            return e.status, e.body()
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats['injected_errors'] += 1
+            if self.error_status == 429:
+                raise ApiError(429, 'rateLimitExceeded', "Too Many Requests")
+            raise ApiError(403, 'rateLimitExceeded', "Rate Limit Exceeded")
+
+    def _dispatch(self, method, path, query, body):
+        parts = [urllib.parse.unquote(p) for p in path.strip('/').split('/')]
+        # calendar/v3/calendars/<calendar>/events[/<event>]
+        if parts[:3] != ['calendar', 'v3', 'calendars'] or len(parts) < 5 or parts[4] != 'events':
+            raise ApiError(404, 'notFound', "Not Found")
+        events = self.calendars.setdefault(parts[3], {})
+        event_id = parts[5] if len(parts) > 5 else None
+
+        if method == 'GET' and event_id is None:
+            self.stats['list'] += 1
+            return 200, self._list(parts[3], events, query)
+        if method == 'POST' and event_id is None:
+            self.stats['insert'] += 1
+            return 200, self._insert(parts[3], events, body)
+        if method == 'PATCH' and event_id:
+            self.stats['patch'] += 1
+            return 200, self._patch(parts[3], events, event_id, body)
+        if method == 'DELETE' and event_id:
+            self.stats['delete'] += 1
+            self._delete(parts[3], events, event_id)
+            return 204, None
+        raise ApiError(405, 'methodNotAllowed', "Method Not Allowed")
+
+    def _changed(self, calendar_id, event_id):
+        self.changes.append((calendar_id, event_id))
+
+    def _list(self, calendar_id, events, query):
+        token = query.get('syncToken')
+        if token:
+            epoch, _, position = token.partition(':')
+            if epoch != self.token_epoch:
+                raise ApiError(410, 'fullSyncRequired', "Sync token is no longer valid")
+            changed = {eid for cid, eid in self.changes[int(position):] if cid == calendar_id}
+            items = [events[eid] for eid in changed if eid in events and 'recurrence' not in events[eid]]
+        else:
+            show_deleted = query.get('showDeleted') == 'true'
+            time_min = _instant({'dateTime': query['timeMin']}) if 'timeMin' in query else None
+            time_max = _instant({'dateTime': query['timeMax']}) if 'timeMax' in query else None
+            prop = query.get('privateExtendedProperty')
+            items = []
+            for event in events.values():
+                if 'recurrence' in event:
+                    continue  # singleEvents: the instances stand for the series
+                if event.get('status') == 'cancelled' and not show_deleted:
+                    continue
+                if time_min and _instant(event['end']) <= time_min:
+                    continue
+                if time_max and _instant(event['start']) >= time_max:
+                    continue
+                if prop:
+                    key, _, value = prop.partition('=')
+                    if event.get('extendedProperties', {}).get('private', {}).get(key) != value:
+                        continue
+                items.append(event)
+        return {'kind': 'calendar#events', 'items': copy.deepcopy(items),
+                'nextSyncToken': f"{self.token_epoch}:{len(self.changes)}"}
+
+    def _insert(self, calendar_id, events, body):
+        event_id = body.get('id') or uuid.uuid4().hex
+        if event_id in events:
+            raise ApiError(409, 'duplicate', "The requested identifier already exists.")
+        event = dict(copy.deepcopy(body), id=event_id, status='confirmed')
+        events[event_id] = event
+        self._changed(calendar_id, event_id)
+        if 'recurrence' in event:
+            self._expand(calendar_id, events, event)
+        return event
+
+    def _expand(self, calendar_id, events, series):
+        """
+        Instances of a weekly series (RRULE:FREQ=WEEKLY;BYDAY=XX[;UNTIL=...Z]) starting at its first
+        occurrence. Occurrences keep their wall-clock time in the series' time zone, across DST changes.
+        Called again when the rule is patched: occurrences after UNTIL are cancelled, the ones an
+        earlier UNTIL cancelled come back, and existing (possibly overridden) ones are kept.
+        """
+        rule = dict(p.split('=') for p in series['recurrence'][0].split(':', 1)[1].split(';'))
+        until = (datetime.datetime.strptime(rule['UNTIL'], '%Y%m%dT%H%M%SZ').replace(tzinfo=UTC)
+                 if 'UNTIL' in rule else None)
+        zone = ZoneInfo(series['start'].get('timeZone', 'UTC'))
+        start = _instant(series['start']).astimezone(zone).replace(tzinfo=None)
+        duration = _instant(series['end']) - _instant(series['start'])
+        if rule.get('FREQ') != 'WEEKLY' or _WEEKDAYS.get(rule.get('BYDAY')) != start.weekday():
+            raise ApiError(400, 'invalid', "Only weekly rules on the first occurrence's day are supported")
+        for week in range(SERIES_WEEKS):
+            occ_start = (start + datetime.timedelta(weeks=week)).replace(tzinfo=zone)
+            instance_id = f"{series['id']}_{occ_start.astimezone(UTC):%Y%m%dT%H%M%SZ}"
+            current = events.get(instance_id)
+            if until and occ_start > until:
+                if current is not None and current.get('status') != 'cancelled':
+                    current['status'] = 'cancelled'
+                    self.truncated.add(instance_id)
+                    self._changed(calendar_id, instance_id)
+                continue
+            if current is not None:
+                if instance_id in self.truncated:
+                    self.truncated.discard(instance_id)
+                    current['status'] = 'confirmed'
+                    self._changed(calendar_id, instance_id)
+                continue
+            instance = {k: copy.deepcopy(v) for k, v in series.items() if k not in ('id', 'recurrence')}
+            instance.update(
+                id=instance_id, recurringEventId=series['id'], status='confirmed',
+                originalStartTime={'dateTime': occ_start.isoformat(), 'timeZone': zone.key},
+                start=dict(series['start'], dateTime=occ_start.isoformat()),
+                end=dict(series['end'], dateTime=(occ_start + duration).isoformat()),
+            )
+            events[instance_id] = instance
+            self._changed(calendar_id, instance_id)
+
+    def _patch(self, calendar_id, events, event_id, body):
+        event = events.get(event_id)
+        if event is None:
+            raise ApiError(404, 'notFound', "Not Found")
+        for key, value in body.items():
+            if value is None:
+                event.pop(key, None)
+            else:
+                event[key] = copy.deepcopy(value)
+        self._changed(calendar_id, event_id)
+        if 'recurrence' in body and 'recurrence' in event:
+            self._expand(calendar_id, events, event)
+        return event
+
+    def _delete(self, calendar_id, events, event_id):
+        event = events.get(event_id)
+        if event is None:
+            raise ApiError(404, 'notFound', "Not Found")
+        if event.get('status') == 'cancelled':
+            raise ApiError(410, 'deleted', "Resource has been deleted")
+        event['status'] = 'cancelled'
+        self._changed(calendar_id, event_id)
+        if 'recurrence' in event:
+            for instance in events.values():
+                if instance.get('recurringEventId') == event_id:
+                    instance['status'] = 'cancelled'
+                    self._changed(calendar_id, instance['id'])
+
+
+def _parse_batch(content_type, body):
+    """The parts of a batch request: (Content-ID, method, path, query, json body)."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    requests = []
+    for part in message.iter_parts():
+        payload = part.get_payload(decode=True).decode('utf-8')
+        head, _, inner_body = payload.partition('\r\n\r\n') if '\r\n\r\n' in payload else payload.partition('\n\n')
+        method, target, _version = head.splitlines()[0].split(' ', 2)
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        requests.append((part['Content-ID'], method, url.path, query,
+                         json.loads(inner_body) if inner_body.strip() else None))
+    return requests
+
+
+_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+            409: 'Conflict', 410: 'Gone', 429: 'Too Many Requests'}
+
+
+class FakeCalendarServer:
+    """
+    The HTTP server, in a background thread.
+    latency_ms is added to every HTTP exchange, item_ms to every request inside a batch.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, item_ms=0.0, error_rate=0.0, error_status=403):
+        self.calendar = FakeCalendar(error_rate, error_status)
+        self.latency_ms = latency_ms
+        self.item_ms = item_ms
+        self.http_requests = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def stats(self):
+        return dict(self.calendar.stats, http_requests=self.http_requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-calendar", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, status, body, content_type='application/json; charset=UTF-8'):
+                data = b'' if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self):
+                server.http_requests += 1
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+
+                if url.path.rstrip('/') == '/batch/calendar/v3':
+                    self._batch(body)
+                    return
+                status, response = server.calendar.handle(self.command, url.path, query,
+                                                          json.loads(body) if body else None)
+                self._respond(status, response)
+
+            def _batch(self, body):
+                server.calendar.stats['batches'] += 1
+                boundary = f"batch_{uuid.uuid4().hex}"
+                out = []
+                for content_id, method, path, query, part_body in _parse_batch(self.headers['Content-Type'], body):
+                    server.calendar.stats['batch_parts'] += 1
+                    if server.item_ms:
+                        time.sleep(server.item_ms / 1000)
+                    status, response = server.calendar.handle(method, path, query, part_body)
+                    data = '' if response is None else json.dumps(response)
+                    response_id = content_id.strip('<>')
+                    out.append(
+                        f"--{boundary}\r\nContent-Type: application/http\r\n"
+                        f"Content-ID: <response-{response_id}>\r\n\r\n"
+                        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                        f"Content-Type: application/json; charset=UTF-8\r\nContent-Length: {len(data.encode())}\r\n\r\n"
+                        f"{data}\r\n"
+                    )
+                out.append(f"--{boundary}--\r\n")
+                self._respond(200, "".join(out).encode('utf-8'), f"multipart/mixed; boundary={boundary}")
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = _handle
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0, help="added to every HTTP request")
+    parser.add_argument('--item-ms', type=float, default=0, help="added to every request inside a batch")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests that fail with a quota error")
+    parser.add_argument('--error-status', type=int, choices=(403, 429), default=403)
+    args = parser.parse_args()
+
+    server = FakeCalendarServer(args.host, args.port, args.latency_ms, args.item_ms, args.error_rate,
+                                args.error_status).start()
+    print(f"Fake Calendar API on {server.url} - Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
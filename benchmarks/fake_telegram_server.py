@@ -0,0 +1,177 @@
+"""
+A local stand-in of the Telegram Bot API, for benchmarks.
+
+Answers the methods the bot calls (getMe, sendMessage, editMessageText, editMessageReplyMarkup,
+answerCallbackQuery...) with plausible results after a configurable latency, and records every
+call with its arrival time, so a benchmark can wait for the bot's reply to an update.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:<port>.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {'id': 777000, 'is_bot': True, 'first_name': 'HilAlon', 'username': 'hilalon_bench_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+@dataclass
+class BotCall:
+    """One Bot API call made by the bot."""
+    index: int
+    method: str
+    params: dict
+    received_at: float  # time.perf_counter()
+    result: object = field(default=None)
+
+    @property
+    def text(self):
+        return self.params.get('text', '')
+
+
+def _parse_params(content_type, body):
+    """Bot API parameters - form-encoded, JSON or multipart; nested values are JSON strings."""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        return {part.get_param('name', header='content-disposition'): part.get_content()
+                for part in message.iter_parts()}
+    return dict(urllib.parse.parse_qsl(body.decode('utf-8')))
+
+
+class BotApi:
+    """
+    Plausible results for the Bot API methods the bot calls. params are the method's
+    parameters as sent on the wire (nested values such as reply_markup JSON-encoded).
+    """
+
+    def __init__(self):
+        self._message_ids = itertools.count(1000)
+
+    def message(self, params, message_id=None):
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+            **({'reply_markup': json.loads(params['reply_markup'])} if params.get('reply_markup') else {}),
+        }
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'sendMessage':
+            return self.message(params)
+        if method in ('editMessageText', 'editMessageReplyMarkup'):
+            if 'inline_message_id' in params:
+                return True
+            return self.message(params, int(params['message_id']))
+        return True
+
+
+class FakeTelegramServer:
+    """The HTTP server, in a background thread. latency_ms is added to every call."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.calls = []
+        self.api = BotApi()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._changed = None
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def counts(self, since=0):
+        """Calls per method, from call number `since` on."""
+        with self._lock:
+            return Counter(call.method for call in self.calls[since:])
+
+    # --- Waiting for the bot (from asyncio code) ---
+
+    def attach(self, loop):
+        """Lets coroutines on `loop` wait for calls (wait_for)."""
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    async def wait_for(self, predicate, since=0, timeout=60):
+        """The first call from number `since` on that matches predicate(call), once it arrives."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self._changed.clear()
+            with self._lock:
+                for call in self.calls[since:]:
+                    if predicate(call):
+                        return call
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("The bot didn't make the expected call")
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def _record(self, method, params):
+        with self._lock:
+            call = BotCall(len(self.calls), method, params, time.perf_counter())
+            call.result = self.api.result(method, params)
+            self.calls.append(call)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        return call.result
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                params = _parse_params(self.headers.get('Content-Type', ''), body)
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                result = server._record(method, params)
+                data = json.dumps({'ok': True, 'result': result}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the bot cancelled the request (e.g. a progress edit at the end of a commit)
+
+            do_GET = do_POST
+
+        return Handler
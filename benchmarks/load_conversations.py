@@ -0,0 +1,368 @@
+"""
+Load test of the conversation handlers.
+
+Simulates many authorized users walking through the planning conversation at the same time
+(/start -> pickups -> date nights -> Kimel -> confirm). Updates are put straight into the real
+Application's update queue; the bot's API calls are answered in-process by a stubbed request
+object (no sockets), and commits go to the in-memory calendar backend - so what is measured is
+the bot process itself: updates/second, p50/p99 latency per step and run time per handler,
+memory per open conversation, and event-loop stalls.
+
+Give several user counts to find the load where the process stops keeping up (latency and
+stalls climb while updates/second stops growing):
+
+    python benchmarks/load_conversations.py --users 100 500 1000 2000 --ramp 5 --think-ms 200
+"""
+import argparse
+import asyncio
+import functools
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_telegram_server import BotApi  # noqa: E402
+from latency_stats import percentile  # noqa: E402
+
+FIRST_USER_ID = 10_000_000
+STALL_THRESHOLD_MS = 10  # event-loop lag above this counts as a stall
+HELD_STEPS = 4  # conversations of the memory measurement stay open after this many steps
+
+
+def make_stub_request():
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """
+        Answers the bot's API calls in-process, after latency_ms (an asyncio sleep, so a slow
+        Telegram costs waiting time but no threads). Keeps the last message of every chat,
+        which is the message the next button press of that user belongs to.
+        """
+
+        def __init__(self, latency_ms=0.0):
+            self.latency_ms = latency_ms
+            self.api = BotApi()
+            self.calls = Counter()
+            self.messages = {}
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                             connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit('/', 1)[-1]
+            params = request_data.json_parameters if request_data else {}
+            self.calls[api_method] += 1
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000)
+            result = self.api.result(api_method, params)
+            if isinstance(result, dict) and 'chat' in result:
+                self.messages[result['chat']['id']] = result
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return StubRequest
+
+
+class HandlerTimer:
+    """
+    Wraps the conversation's callbacks: records how long each handler ran, and wakes the
+    simulated user waiting for its update to be handled.
+    """
+
+    def __init__(self):
+        self.run_ms = defaultdict(list)
+        self.waiters = {}  # update_id -> future, resolved with the time the handler returned
+
+    def _wrap(self, handler):
+        callback = handler.callback
+
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                done = time.perf_counter()
+                self.run_ms[callback.__name__].append((done - started) * 1000)
+                waiter = self.waiters.pop(update.update_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(done)
+
+        handler.callback = timed
+
+    def instrument(self, app):
+        from telegram.ext import ConversationHandler
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    for inner in itertools.chain(handler.entry_points, *handler.states.values(), handler.fallbacks):
+                        self._wrap(inner)
+
+
+class LoopMonitor:
+    """Event-loop lag: a task sleeps `interval` over and over and records how late it wakes up."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags_ms = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags_ms.append((loop.time() - expected) * 1000)
+
+    def start(self):
+        self.lags_ms = []
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+        stalls = [lag for lag in self.lags_ms if lag > STALL_THRESHOLD_MS]
+        return {'lag_p50_ms': round(percentile(self.lags_ms, 0.5, 0.0), 1),
+                'lag_p99_ms': round(percentile(self.lags_ms, 0.99, 0.0), 1),
+                'lag_max_ms': round(max(self.lags_ms, default=0), 1),
+                'stalls': len(stalls), 'stalled_ms': round(sum(stalls))}
+
+
+class LoadRun:
+    """The application under test and the simulated users driving it."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, app, stub, timer, args, cfg):
+        self.app = app
+        self.stub = stub
+        self.timer = timer
+        self.args = args
+        self.cfg = cfg
+        self.step_ms = defaultdict(list)
+        self.timeouts = 0
+
+    def steps(self, rng):
+        cfg = self.cfg
+        day = rng.randrange(6)
+        return [
+            ("start", None),
+            ("pickup_toggle", f"{cfg.PREFIX_PICKUP}{day}"),
+            ("pickup_done", f"{cfg.PREFIX_PICKUP}{cfg.ACTION_DONE}"),
+            ("date_a", f"{cfg.PREFIX_DATE_HILA}{day}"),
+            ("date_b", f"{cfg.PREFIX_DATE_ALON}{(day + 1) % 7}"),
+            ("kimel_toggle", f"{cfg.PREFIX_KIMEL}{rng.randrange(6)}"),
+            ("summary", f"{cfg.PREFIX_KIMEL}{cfg.ACTION_DONE}"),
+            ("confirm", cfg.ACTION_CONFIRM),
+        ]
+
+    def _update(self, user_id, data):
+        from telegram import Update
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+        if data is None:
+            payload = {'message': {'message_id': 1, 'date': int(time.time()), 'text': "/start", 'from': user,
+                                   'chat': {'id': user_id, 'type': 'private'},
+                                   'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+        else:
+            payload = {'callback_query': {'id': str(user_id), 'from': user, 'chat_instance': str(user_id),
+                                          'data': data, 'message': self.stub.messages[user_id]}}
+        return Update.de_json(dict(payload, update_id=next(self._update_ids)), self.app.bot)
+
+    async def walk(self, user_id, steps, delay=0.0, think_ms=0.0, rng=None):
+        """One user through `steps`; returns the number of updates handled."""
+        await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        for handled, (step, data) in enumerate(steps):
+            if handled and think_ms:
+                await asyncio.sleep(rng.uniform(0, think_ms) / 1000)
+            update = self._update(user_id, data)
+            waiter = self.timer.waiters[update.update_id] = loop.create_future()
+            queued = time.perf_counter()
+            await self.app.update_queue.put(update)
+            try:
+                done = await asyncio.wait_for(waiter, self.args.timeout)
+            except asyncio.TimeoutError:
+                self.timer.waiters.pop(update.update_id, None)
+                self.timeouts += 1
+                return handled
+            self.step_ms[step].append((done - queued) * 1000)
+        return len(steps)
+
+    async def hold_conversations(self, user_ids):
+        """Opens conversations that stay open for the rest of the run; returns bytes allocated per conversation."""
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await asyncio.gather(*(self.walk(user_id, self.steps(random.Random(user_id))[:HELD_STEPS])
+                               for user_id in user_ids))
+        await asyncio.sleep(self.cfg.EDIT_DEBOUNCE_DELAY * 2)  # pending keyboard edits go out
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / len(user_ids)
+
+    async def load_level(self, user_ids, monitor):
+        from commit_queue import commit_jobs
+
+        self.step_ms.clear()
+        self.timer.run_ms.clear()
+        self.timeouts = 0
+        calls_before = Counter(self.stub.calls)
+        spacing = self.args.ramp / len(user_ids)
+
+        monitor.start()
+        started = time.perf_counter()
+        handled = await asyncio.gather(*(
+            self.walk(user_id, self.steps(random.Random(user_id)), i * spacing, self.args.think_ms,
+                      random.Random(-user_id))
+            for i, user_id in enumerate(user_ids)))
+        elapsed = time.perf_counter() - started
+        loop_stats = monitor.stop()
+
+        # The commit workers write the confirmed weeks in the background
+        drain_started = time.perf_counter()
+        while True:
+            depth = await asyncio.to_thread(commit_jobs.stats)
+            if not depth['queued'] and not depth['running']:
+                break
+            await asyncio.sleep(0.05)
+        updates = sum(handled)
+
+        return {
+            'users': len(user_ids),
+            'updates': updates,
+            'seconds': round(elapsed, 2),
+            'updates_per_s': round(updates / elapsed, 1),
+            'timeouts': self.timeouts,
+            'latency_ms': {step: {'p50': round(percentile(v, 0.5), 1), 'p99': round(percentile(v, 0.99), 1)}
+                           for step, v in self.step_ms.items()},
+            'all_steps_ms': {'p50': round(percentile(list(itertools.chain(*self.step_ms.values())), 0.5, 0.0), 1),
+                             'p99': round(percentile(list(itertools.chain(*self.step_ms.values())), 0.99, 0.0), 1)},
+            'handler_run_ms': {name: {'p50': round(percentile(v, 0.5), 2), 'p99': round(percentile(v, 0.99), 2)}
+                               for name, v in self.timer.run_ms.items()},
+            'event_loop': loop_stats,
+            'commits_drained_s': round(time.perf_counter() - drain_started, 2),
+            'telegram_calls_per_user': {m: round(n / len(user_ids), 2)
+                                        for m, n in sorted((Counter(self.stub.calls) - calls_before).items())},
+        }
+
+
+def configure_environment(args, user_ids):
+    """The bot reads its configuration at import - set it before importing telegram_bot."""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': "123456:LOADTEST",
+        'ADMIN_CHAT_ID': ",".join(map(str, user_ids)),  # one household with every simulated user
+        'CALENDAR_ID': "load@group.calendar.google.com",
+        'CALENDAR_BACKEND': "memory",
+        'CONCURRENT_UPDATES': str(args.concurrent_updates),
+        'TELEGRAM_RPS': str(args.telegram_rps),
+        'SINGLE_MESSAGE_FLOW': "1" if args.single_message_flow else "0",
+        'TENANTS_FILE': "",
+    })
+
+
+async def run_load(args, held_ids, levels):
+    import config as cfg
+    import telegram_bot
+    from webhook_server import UpdateLatency
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    stub = make_stub_request()(args.telegram_latency_ms)
+    latency = UpdateLatency(max_samples=1_000_000)
+    app = telegram_bot.build_application(latency, request=stub)
+    timer = HandlerTimer()
+    timer.instrument(app)
+    for job in app.job_queue.get_jobs_by_name("thursday_push"):
+        job.schedule_removal()  # would message every simulated user
+
+    report = {'levels': []}
+    async with app:
+        await app.start()
+        if held_ids:
+            report['bytes_per_conversation'] = round(await LoadRun(app, stub, timer, args, cfg)
+                                                     .hold_conversations(held_ids))
+        monitor = LoopMonitor()
+        for user_ids in levels:
+            latency.queue_to_handler.clear()
+            level = await LoadRun(app, stub, timer, args, cfg).load_level(user_ids, monitor)
+            level['queue_wait_ms'] = latency.summary()['queue_to_handler']
+            report['levels'].append(level)
+            print_level(level)
+        await app.stop()
+    report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def print_level(level):
+    loop = level['event_loop']
+    queue = level['queue_wait_ms'] or {}
+    print(f"\n{level['users']} users: {level['updates']} updates in {level['seconds']}s = "
+          f"{level['updates_per_s']} updates/s, {level['timeouts']} timeouts")
+    print(f"  latency (queued -> handled) p50 {level['all_steps_ms']['p50']} ms, p99 {level['all_steps_ms']['p99']} ms; "
+          f"queue wait p99 {queue.get('p99_ms')} ms")
+    print(f"  event loop: lag p99 {loop['lag_p99_ms']} ms, max {loop['lag_max_ms']} ms, "
+          f"{loop['stalls']} stalls > {STALL_THRESHOLD_MS} ms ({loop['stalled_ms']} ms in total)")
+    print(f"  commits drained {level['commits_drained_s']}s after the last confirmation")
+    print(f"  {'step':<16}{'p50 ms':>10}{'p99 ms':>10}")
+    for step, s in level['latency_ms'].items():
+        print(f"  {step:<16}{s['p50']:>10.1f}{s['p99']:>10.1f}")
+    print(f"  {'handler run time':<28}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, s in level['handler_run_ms'].items():
+        print(f"  {name:<28}{s['p50']:>10.2f}{s['p99']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 500, 1000],
+                        help="concurrent users of each load level (levels run one after the other)")
+    parser.add_argument('--ramp', type=float, default=2, help="seconds over which a level's users start")
+    parser.add_argument('--think-ms', type=float, default=100, help="maximum random pause between a user's steps")
+    parser.add_argument('--hold', type=int, default=500,
+                        help="conversations opened first and kept open, to measure memory per conversation")
+    parser.add_argument('--telegram-latency-ms', type=float, default=0, help="delay of every stubbed API call")
+    parser.add_argument('--telegram-rps', type=float, default=1_000_000,
+                        help="the bot's own Telegram pacing (TELEGRAM_RPS); by default high enough to measure "
+                             "the process rather than the pacing - pass 25 to load the bot as deployed")
+    parser.add_argument('--concurrent-updates', type=int, default=16)
+    parser.add_argument('--single-message-flow', action='store_true')
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for one update to be handled")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    ids = itertools.count(FIRST_USER_ID)
+    held_ids = [next(ids) for _ in range(args.hold)]
+    levels = [[next(ids) for _ in range(users)] for users in args.users]
+    configure_environment(args, held_ids + [user_id for level in levels for user_id in level])
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    with tempfile.TemporaryDirectory(prefix="hilalon-load-") as workdir:
+        os.chdir(workdir)  # the bot's SQLite files stay out of the repository
+        report = asyncio.run(run_load(args, held_ids, levels))
+
+    if 'bytes_per_conversation' in report:
+        print(f"\nMemory per open conversation: {report['bytes_per_conversation'] / 1024:.1f} KiB "
+              f"({args.hold} conversations)")
+    print(f"Peak RSS: {report['peak_rss_mb']} MiB")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import abc
+import datetime
+import io
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import List
+import pytz
+import config as cfg
+from event_plan import compile_week, week_context
+
+logger = logging.getLogger(__name__)
+
+# --- Calendar backends ---
+# A commit compiles the weeks into event specs (event_plan) and hands them, all at once, to a
+# backend that writes them somewhere. GoogleBackend (calendar_utils.py) syncs a Google Calendar;
+# IcsBackend writes an .ics file and MemoryBackend keeps the events in a dictionary - neither
+# touches the network, so plans can be exported or dry-run, and the generation pipeline can be
+# measured without any I/O. cfg.CALENDAR_BACKEND picks the backend the bot commits to.
+
+# Guards the households' Kimel counters (commits run in parallel worker threads)
+kimel_lock = threading.Lock()
+
+
+@dataclass
+class SyncReport:
+    """
+    What a sync did: counts per change type, failed changes (by title) and API requests sent.
+    undo - the changes that take the successful ones back (newest first).
+    rolled_back - an atomic sync failed and took its changes back; rollback_failed lists
+    the changes it could not take back.
+    """
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    failed: List[str] = field(default_factory=list)
+    requests: int = 0
+    undo: list = field(default_factory=list)
+    rolled_back: bool = False
+    rollback_failed: List[str] = field(default_factory=list)
+
+    @property
+    def changes(self):
+        return self.inserted + self.updated + self.deleted
+
+
+class CalendarBackend(abc.ABC):
+    """Writes the planned events of one or more weeks."""
+
+    @abc.abstractmethod
+    def write_weeks(self, specs, window_starts, on_progress=None):
+        """
+        Makes the backend hold exactly `specs` (EventSpecs) for the weeks starting at window_starts.
+        Returns a SyncReport.
+        """
+
+
+def _ics_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _ics_time(dt):
+    return dt.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _fold(line):
+    """Folds a content line at 75 octets (RFC 5545), never inside a UTF-8 character."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while len(data) > 75 - (1 if parts else 0):
+        cut = 75 - (1 if parts else 0)
+        while data[cut] & 0xC0 == 0x80:  # a continuation byte - step back to the character's start
+            cut -= 1
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    parts.append(data.decode('utf-8'))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+class IcsBackend(CalendarBackend):
+    """
+    Writes the events as an iCalendar file - a path, or any writable text stream.
+    The file is rendered into one buffer and written with a single write() call.
+    Times are written in UTC, so the file needs no VTIMEZONE block.
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+
+    def render(self, specs):
+        stamp = _ics_time(datetime.datetime.now(pytz.utc))
+        buf = io.StringIO()
+        buf.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//HilAlon Bot//Weekly schedule//HE\r\n"
+                  "CALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n")
+        for spec in specs:
+            buf.write("BEGIN:VEVENT\r\n")
+            buf.write(f"UID:{spec.event_id}@hilalon\r\n")
+            buf.write(f"DTSTAMP:{stamp}\r\n")
+            buf.write(f"DTSTART:{_ics_time(spec.start)}\r\n")
+            buf.write(f"DTEND:{_ics_time(spec.end)}\r\n")
+            buf.write(_fold(f"SUMMARY:{_ics_text(spec.summary)}"))
+            buf.write(_fold(f"DESCRIPTION:{_ics_text(spec.description)}"))
+            for minutes in sorted({m for m in spec.reminders if m is not None and m >= 0}, reverse=True):
+                buf.write("BEGIN:VALARM\r\nACTION:DISPLAY\r\n")
+                buf.write(_fold(f"DESCRIPTION:{_ics_text(spec.summary)}"))
+                buf.write(f"TRIGGER:-PT{minutes}M\r\nEND:VALARM\r\n")
+            buf.write("END:VEVENT\r\n")
+        buf.write("END:VCALENDAR\r\n")
+        return buf.getvalue()
+
+    def write_weeks(self, specs, window_starts, on_progress=None):
+        text = self.render(specs)
+        if isinstance(self.destination, str):
+            with open(self.destination, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+        else:
+            self.destination.write(text)
+        if on_progress:
+            on_progress(len(specs), len(specs))
+        return SyncReport(inserted=len(specs))
+
+
+class MemoryBackend(CalendarBackend):
+    """
+    Keeps the events in a dictionary (event ID -> EventSpec), with the same replace-the-weeks
+    semantics as the Google sync: a commit inserts, updates and deletes within its weeks only.
+    """
+
+    def __init__(self):
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def write_weeks(self, specs, window_starts, on_progress=None):
+        window_days = {day for start in window_starts for day in week_context(start).dates}
+        planned = {spec.event_id: spec for spec in specs}
+        report = SyncReport()
+        with self._lock:
+            for event_id, spec in planned.items():
+                current = self.events.get(event_id)
+                if current is None:
+                    report.inserted += 1
+                elif current != spec:
+                    report.updated += 1
+                else:
+                    report.unchanged += 1
+                self.events[event_id] = spec
+            for event_id in [i for i, spec in self.events.items()
+                             if i not in planned and spec.anchor_date in window_days]:
+                del self.events[event_id]
+                report.deleted += 1
+        if on_progress:
+            on_progress(report.changes, report.changes)
+        return report
+
+
+def restore_kimel(state, kimel):
+    state[cfg.KIMEL_COUNTER_KEY] = kimel['counter']
+    state[cfg.KIMEL_WEEK_START_KEY] = dict(kimel['week_starts'])
+
+
+def commit_weeks_to(backend, tenant, schedules, window_starts, state, on_progress=None, commit_id=None):
+    """
+    Commits one or more weeks of a household to `backend`:
+    schedules[i] (WeeklySchedule) is planned for the 7 days starting at window_starts[i].
+    state is the household's counters (tenants.tenant_state).
+    commit_id identifies the commit across its attempts (the commit job ID), so the undo of a
+    retry is added to the one of the attempts before it.
+    All weeks are compiled first, then written together. Returns the backend's SyncReport.
+    """
+    profile = tenant.profile
+
+    # Kimel numbering of a week starts from the value the counter had the first time that week
+    # was committed, so committing it again keeps the same numbers (and doesn't advance the counter twice).
+    # The lock makes the counter read-modify-write atomic when two confirmations race.
+    with kimel_lock:
+        week_starts = state.setdefault(cfg.KIMEL_WEEK_START_KEY, {})
+        kimel_counter = state.get(cfg.KIMEL_COUNTER_KEY, profile.kimel_initial)
+        kimel_before = {'counter': kimel_counter, 'week_starts': dict(week_starts)}
+        specs = []
+        for schedule_obj, window_start in zip(schedules, window_starts):
+            week_key = window_start.isoformat()
+            week_starts.setdefault(week_key, kimel_counter)
+            week_specs, kimel_counter = compile_week(schedule_obj, window_start, week_starts[week_key], profile)
+            specs.extend(week_specs)
+        for old_key in sorted(week_starts)[:-cfg.KIMEL_WEEKS_TO_REMEMBER]:
+            del week_starts[old_key]
+        state[cfg.KIMEL_COUNTER_KEY] = kimel_counter
+
+    report = backend.write_weeks(specs, window_starts, on_progress=on_progress)
+
+    with kimel_lock:
+        if report.rolled_back:
+            # Nothing was committed, so the counter doesn't move either. The undo of the
+            # commit before this one is dropped too, so /undo can't take back an older week.
+            restore_kimel(state, kimel_before)
+            state.pop(cfg.LAST_COMMIT_KEY, None)
+        elif report.undo:
+            last = state.get(cfg.LAST_COMMIT_KEY)
+            if commit_id is not None and last and last.get('commit_id') == commit_id:
+                # A retry: its changes came after the earlier attempts', so they are undone first,
+                # and the counter goes back to where it was before the first attempt
+                last['undo'] = report.undo + last['undo']
+                return report
+            state[cfg.LAST_COMMIT_KEY] = {
+                'commit_id': commit_id,
+                'weeks': [start.isoformat() for start in window_starts],
+                'undo': report.undo,
+                'kimel': kimel_before,
+            }
+    return report
+
+
+def format_results_message(report):
+    """
+    Builds the message shown to the user after the commit, based on its SyncReport.
+    """
+    if not report.failed:
+        return (
+            f"✅ הסתיים בהצלחה! היומן מעודכן.\n"
+            f"➕ נוצרו: {report.inserted} | ✏️ עודכנו: {report.updated} | "
+            f"🗑 נמחקו: {report.deleted} | ללא שינוי: {report.unchanged}"
+        )
+
+    failed_txt = "\n".join(f"• {label}" for label in report.failed)
+    if report.rolled_back:
+        text = (
+            f"❌ {len(report.failed)} שינויים ביומן נכשלו, ולכן אף שינוי לא נשמר - היומן נשאר כמו שהיה.\n"
+            f"השינויים שנכשלו:\n{failed_txt}"
+        )
+        if report.rollback_failed:
+            rollback_txt = "\n".join(f"• {label}" for label in report.rollback_failed)
+            text += f"\n⚠️ לא ניתן היה לבטל את השינויים הבאים:\n{rollback_txt}"
+        return text
+
+    return (
+        f"⚠️ {report.changes - len(report.failed)} מתוך {report.changes} שינויים ביומן הצליחו.\n"
+        f"השינויים הבאים נכשלו:\n{failed_txt}"
+    )
@@ -0,0 +1,239 @@
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import config as cfg
+from event_plan import BOT_TAG
+from tenants import tenants
+from throttling import call_google, google_error_status
+from startup import calendar_loaded, calendar_module, load_calendar
+
+logger = logging.getLogger(__name__)
+
+# --- Local calendar mirror ---
+# A copy of every household calendar in SQLite, indexed by start time, so questions like
+# "what is already on Tuesday evening" are answered locally instead of with an events.list
+# call per question. The mirror is kept current with incremental syncs (events.list with the
+# syncToken of the previous sync); a full resync happens only on the first sync of a calendar
+# and when Google invalidates the token (410 Gone).
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_ts REAL NOT NULL,  -- UTC epoch seconds (all-day events: local midnight)
+    end_ts REAL NOT NULL,
+    summary TEXT,
+    is_bot INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (calendar_id, start_ts);
+CREATE TABLE IF NOT EXISTS sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def event_time(when):
+    """Event start/end (dateTime or all-day date) -> UTC epoch seconds."""
+    if 'dateTime' in when:
+        dt = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+        if dt.tzinfo is None:
+            dt = cfg.TIME_ZONE.localize(dt)
+    else:
+        day = datetime.date.fromisoformat(when['date'])
+        dt = cfg.TIME_ZONE.localize(datetime.datetime.combine(day, datetime.time()))
+    return dt.timestamp()
+
+
+class CalendarMirror:
+    """
+    The mirror database. sync() is blocking (Google calls) - run it in a worker thread;
+    the read methods are short indexed queries and may be called from anywhere.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._conn = None
+        self._lock = threading.Lock()
+        self._longest = {}  # calendar_id -> longest event duration (s); bounds the range queries
+        self._sync_locks = {}  # calendar_id -> lock held for a whole sync of that calendar
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    # --- Sync ---
+
+    def sync(self, target):
+        """
+        Brings the mirror of target.calendar_id (a calendar_utils.CalendarTarget) up to date.
+        Returns the number of events that changed.
+        Syncs of the same calendar (the periodic one, the one after a commit...) run one at a
+        time, so each one starts from the token the previous one stored and deltas are applied in order.
+        """
+        with self._lock:
+            sync_lock = self._sync_locks.setdefault(target.calendar_id, threading.Lock())
+        with sync_lock:
+            return self._sync(target)
+
+    def _sync(self, target):
+        with self._lock:
+            row = self._connect().execute("SELECT sync_token FROM sync_state WHERE calendar_id = ?",
+                                          (target.calendar_id,)).fetchone()
+        token = row[0] if row else None
+
+        if token:
+            try:
+                items, next_token = self._list(target, syncToken=token)
+            except Exception as e:
+                if google_error_status(e) != 410:
+                    raise
+                logger.warning(f"Sync token of {target.calendar_id} expired - full resync")
+                token = None
+        if not token:
+            items, next_token = self._list(target)
+
+        self._apply(target.calendar_id, items, next_token, full=not token)
+        if token:
+            self.incremental_syncs += 1
+        else:
+            self.full_syncs += 1
+        logger.info(f"Calendar mirror of {target.calendar_id}: {'incremental' if token else 'full'} sync, "
+                    f"{len(items)} changed events")
+        return len(items)
+
+    @staticmethod
+    def _list(target, **params):
+        """All pages of one events.list query. Returns (items, nextSyncToken)."""
+        items = []
+        page_token = None
+        while True:
+            response = call_google(target.service.events().list(
+                calendarId=target.calendar_id,
+                singleEvents=True,
+                showDeleted='syncToken' in params,  # a full sync only needs what exists now
+                maxResults=2500,
+                pageToken=page_token,
+                **params,
+            ), bucket=target.bucket)
+            items.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return items, response.get('nextSyncToken')
+
+    def _apply(self, calendar_id, items, sync_token, full):
+        rows = []
+        removed = []
+        for event in items:
+            if event.get('status') == 'cancelled' or 'start' not in event:
+                removed.append((calendar_id, event['id']))
+                continue
+            is_bot = event.get('extendedProperties', {}).get('private', {}).get(BOT_TAG) == '1'
+            rows.append((calendar_id, event['id'], event_time(event['start']), event_time(event['end']),
+                         event.get('summary'), int(is_bot), json.dumps(event)))
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if full:
+                    conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+                conn.executemany("DELETE FROM events WHERE calendar_id = ? AND event_id = ?", removed)
+                conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                             (calendar_id, sync_token, time.time()))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            # Deleted events don't shorten it - a longer bound only widens the scan a little
+            if full or calendar_id not in self._longest:
+                self._longest.pop(calendar_id, None)
+            else:
+                self._longest[calendar_id] = max([self._longest[calendar_id]]
+                                                 + [end - start for _c, _e, start, end, *_rest in rows])
+
+    # --- Reads ---
+
+    def _longest_duration(self, conn, calendar_id):
+        """The longest event of the calendar (seconds); computed with one scan the first time (lock held)."""
+        longest = self._longest.get(calendar_id)
+        if longest is None:
+            row = conn.execute("SELECT MAX(end_ts - start_ts) FROM events WHERE calendar_id = ?",
+                               (calendar_id,)).fetchone()
+            longest = self._longest[calendar_id] = row[0] or 0
+        return longest
+
+    def events_between(self, calendar_id, start, end, include_bot=True):
+        """
+        Events of the calendar that overlap [start, end) (aware datetimes), ordered by start.
+        Each one is the event resource as Google returned it.
+        An overlapping event starts no earlier than `start` minus the longest event, so the
+        index range scan covers just the window instead of the calendar's whole past.
+        """
+        sql = ("SELECT body FROM events WHERE calendar_id = ? AND start_ts >= ? AND start_ts < ? AND end_ts > ?"
+               + ("" if include_bot else " AND is_bot = 0") + " ORDER BY start_ts")
+        with self._lock:
+            conn = self._connect()
+            lower = start.timestamp() - self._longest_duration(conn, calendar_id)
+            rows = conn.execute(sql, (calendar_id, lower, end.timestamp(), start.timestamp())).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def synced_at(self, calendar_id):
+        """When the calendar was last synced (epoch seconds), or None if it never was."""
+        with self._lock:
+            row = self._connect().execute("SELECT synced_at FROM sync_state WHERE calendar_id = ?",
+                                          (calendar_id,)).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._connect().execute(
+                "SELECT calendar_id, COUNT(*) FROM events GROUP BY calendar_id").fetchall())
+        return {'events': counts, 'full_syncs': self.full_syncs, 'incremental_syncs': self.incremental_syncs}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+calendar_mirror = CalendarMirror(cfg.MIRROR_FILE)
+
+
+def sync_tenant(tenant, on_progress=None):
+    """Syncs one household's calendar into the mirror (blocking)."""
+    return calendar_mirror.sync(calendar_module().calendar_target(tenant))
+
+
+async def sync_tenant_async(tenant):
+    """Awaitable version of sync_tenant (runs in the calendar executor)."""
+    calendar = await load_calendar()
+    return await calendar.run_calendar_job(sync_tenant, tenant)
+
+
+async def sync_calendar_mirrors(context):
+    """
+    Job callback: keeps the mirror of every household's calendar current - once the Google
+    stack is loaded, so a negative cfg.CALENDAR_WARMUP_DELAY still defers it to the first confirmation.
+    """
+    if not calendar_loaded():
+        return
+    for tenant in tenants:
+        try:
+            await sync_tenant_async(tenant)
+        except Exception as e:
+            logger.error(f"Calendar mirror sync failed ({tenant.tenant_id}): {e}")
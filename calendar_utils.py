@@ -1,69 +1,211 @@
+import asyncio
 import datetime
+import functools
+import hashlib
+import json
 import os.path
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+import pytz
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.http import HttpRequest
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
+from dataclasses import dataclass, field
 import config as cfg
+from event_plan import BOT_TAG, make_event_id, week_context
+from calendar_backends import CalendarBackend, SyncReport, kimel_lock, restore_kimel
+from throttling import (backoff_delay, call_google, google_bucket, google_bucket_for, google_error_status,
+                        google_retry_after, google_stats, is_transient_google_error)
 
 logger = logging.getLogger(__name__)
 
 # Calendar access permissions
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# Bounded pool for the blocking Google calls, so they never run on the asyncio event loop
+_calendar_executor = ThreadPoolExecutor(max_workers=cfg.CALENDAR_WORKERS, thread_name_prefix="calendar")
 
-def get_calendar_service():
+class CalendarServiceHolder:
     """
-    Function responsible for connecting to Google.
-    If it's the first time, a browser window will open for authorization.
-    After that, a token.json file will be created to save the connection.
+    Process-wide holder of the Calendar service.
+    The service is built once (from the static discovery document bundled with
+    googleapiclient, so no discovery HTTP call) and reused by every confirmation.
+    The OAuth token is refreshed ahead of expiry by refresh_if_expiring(),
+    and token.json is rewritten only when the token actually changed.
     """
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists(cfg.CALENDAR_CREDENTIALS_FILE):
-                raise FileNotFoundError(f"Missing credentials file: {cfg.CALENDAR_CREDENTIALS_FILE}")
+    def __init__(self, token_file):
+        self.token_file = token_file
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._creds = None
+        self._service = None
+        self._saved_token = None
+
+    def get(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials(interactive=True)
+            if not self._creds.valid:
+                self._refresh()
+            if self._service is None:
+                self._service = self._build_service()
+            return self._service
+
+    def refresh_if_expiring(self, margin):
+        """
+        Refreshes the token if it expires within `margin` (timedelta).
+        Never opens the browser flow - if there is no token yet it does nothing.
+        Returns True if a refresh happened.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials(interactive=False)
+                if self._creds is None:
+                    return False
+
+            expiry = self._creds.expiry  # naive UTC
+            if expiry is not None and expiry - datetime.datetime.utcnow() > margin:
+                return False
+            if not getattr(self._creds, 'refresh_token', None):
+                return False
+
+            self._refresh()
+            return True
+
+    def _load_credentials(self, interactive):
+        if cfg.GOOGLE_API_ENDPOINT:
+            # A local stand-in of the API takes no credentials
+            return AnonymousCredentials()
+
+        creds = None
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+            with open(self.token_file) as token:
+                self._saved_token = token.read()
+
+        if creds and (creds.valid or creds.refresh_token):
+            return creds
+        if not interactive:
+            return None
+
+        if not os.path.exists(cfg.CALENDAR_CREDENTIALS_FILE):
+            raise FileNotFoundError(f"Missing credentials file: {cfg.CALENDAR_CREDENTIALS_FILE}")
+
+        flow = InstalledAppFlow.from_client_secrets_file(
+            cfg.CALENDAR_CREDENTIALS_FILE, SCOPES)
+        creds = flow.run_local_server(port=0, open_browser=False)
+        self._save_token(creds)
+        return creds
+
+    def _refresh(self):
+        self._creds.refresh(Request())
+        logger.info(f"Calendar token refreshed, valid until {self._creds.expiry}")
+        self._save_token(self._creds)
+
+    def _save_token(self, creds):
+        """Writes token.json atomically (temp file + rename), only if its content changed."""
+        data = creds.to_json()
+        if data == self._saved_token:
+            return
+
+        tmp_path = f"{self.token_file}.tmp"
+        with open(tmp_path, 'w') as token:
+            token.write(data)
+            token.flush()
+            os.fsync(token.fileno())
+        os.replace(tmp_path, self.token_file)
+        self._saved_token = data
+
+    def _build_service(self):
+        # httplib2.Http is not thread-safe, so every worker thread gets its own
+        # authorized connection while all of them share the one parsed service.
+        def build_request(_http, *args, **kwargs):
+            if not hasattr(self._local, 'http'):
+                self._local.http = AuthorizedHttp(self._creds, http=httplib2.Http())
+            return HttpRequest(self._local.http, *args, **kwargs)
+
+        http = AuthorizedHttp(self._creds, http=httplib2.Http())
+        if cfg.GOOGLE_API_ENDPOINT:
+            # The batch endpoint is derived from rootUrl, so point the whole document at the stand-in
+            document = json.loads(discovery_cache.get_static_doc('calendar', 'v3'))
+            document['rootUrl'] = cfg.GOOGLE_API_ENDPOINT
+            return build_from_document(document, http=http, requestBuilder=build_request)
+
+        return build(
+            'calendar', 'v3',
+            http=http,
+            requestBuilder=build_request,
+            static_discovery=True,
+            cache_discovery=False,
+        )
 
-            flow = InstalledAppFlow.from_client_secrets_file(
-                cfg.CALENDAR_CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0, open_browser=False)
 
+_service_holders = {}  # token file -> CalendarServiceHolder (households may share a Google account)
+_service_holders_lock = threading.Lock()
 
-        # Save token for next time
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
 
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+def _service_holder(token_file):
+    with _service_holders_lock:
+        holder = _service_holders.get(token_file)
+        if holder is None:
+            holder = _service_holders[token_file] = CalendarServiceHolder(token_file)
+        return holder
 
 
-def get_next_weekday(start_date, weekday_index):
+def get_calendar_service(token_file=cfg.TOKEN_FILE):
     """
-    Calculates the nearest date of a specific day of the week.
-    weekday_index: 0=Sunday, 1=Monday ... 6=Saturday (according to our indices)
+    Function responsible for connecting to Google.
+    If it's the first time, a browser window will open for authorization.
+    After that, a token.json file will be created to save the connection.
+    The service is cached for the lifetime of the process.
     """
-    # Convert to Python's weekday indices (0=Monday, 6=Sunday)
-    # Our format: 0=Sunday -> Python: 6
-    # Our format: 1=Monday -> Python: 0
-    python_weekday = (weekday_index - 1) % 7
+    return _service_holder(token_file).get()
+
 
-    days_ahead = python_weekday - start_date.weekday()
-    if days_ahead <= 0:
-        # If this day has already passed this week (or is today), set to next week
-        days_ahead += 7
+@dataclass(frozen=True)
+class CalendarTarget:
+    """Where a sync goes: the Calendar service, the household's calendar and the bucket of its OAuth token."""
+    service: object
+    calendar_id: str
+    bucket: object = google_bucket
 
-    return start_date + datetime.timedelta(days=days_ahead)
 
+def calendar_target(tenant):
+    return CalendarTarget(get_calendar_service(tenant.token_file), tenant.calendar_id,
+                          google_bucket_for(tenant.token_file))
 
-def create_event(service, summary, description, start_dt, end_dt,
-                 color_id=None, reminder_minutes=(30, 10)):
 
+async def refresh_calendar_token(context):
+    """
+    Job-queue callback: refreshes the OAuth token in the background before it expires,
+    so confirmations never pay for a token refresh.
+    """
+    margin = datetime.timedelta(seconds=cfg.TOKEN_REFRESH_MARGIN)
+    loop = asyncio.get_running_loop()
+    _service_holder(cfg.TOKEN_FILE)  # the default token is kept fresh even before the first commit
+    with _service_holders_lock:
+        holders = list(_service_holders.values())
+    for holder in holders:
+        try:
+            await loop.run_in_executor(_calendar_executor, holder.refresh_if_expiring, margin)
+        except Exception as e:
+            logger.error(f"Background token refresh failed ({holder.token_file}): {e}")
+
+
+def build_event_body(summary, description, start_dt, end_dt,
+                     color_id=None, reminder_minutes=(30, 10)):
+    """
+    Builds the Google Calendar event resource (the request body) without sending it.
+    """
     event = {
         'summary': summary,
         'description': description,
@@ -90,152 +232,537 @@ def create_event(service, summary, description, start_dt, end_dt,
             ]
         }
 
-    try:
-        service.events().insert(calendarId=cfg.CALENDAR_ID, body=event).execute()
-        logger.info(f"Created event: {summary} at {start_dt}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to create event {summary}: {e}")
-        return False
+    return event
 
 
-
-def create_weekly_events_in_calendar(schedule_obj, bot_data):
+def execute_batch(service, calls, on_progress=None, bucket=google_bucket):
     """
-    The main function!
-    Receives the schedule object (WeeklySchedule) created in the bot,
-    iterates over it and creates all events in Google Calendar.
+    Sends a list of API requests (insert / patch / delete...) through the Calendar batch endpoint.
+    `calls` is a list of (label, request) pairs. The list is split into chunks of
+    cfg.CALENDAR_BATCH_SIZE (the per-batch limit), so a whole week usually goes out
+    in a single HTTP round trip. Every chunk is paced by `bucket` (the household's Google bucket).
+
+    Requests that fail with a transient error (rate limit, 5xx, network) are sent again
+    in a later batch, with backoff, up to cfg.RETRY_MAX_ATTEMPTS times in total.
+
+    on_progress(done, total) is called after every request that reaches its final result.
+
+    Returns a list aligned with `calls`: None for a request that succeeded,
+    or the exception that made it fail.
     """
-    service = get_calendar_service()
-    today = datetime.date.today()
-    created_count = 0
+    errors = [None] * len(calls)
+    done = 0
+
+    def on_response(request_id, response, exception):
+        # request_id is the index of the request in `calls`
+        errors[int(request_id)] = exception
+
+    pending = list(range(len(calls)))
+    attempt = 0
+    while pending:
+        for chunk_start in range(0, len(pending), cfg.CALENDAR_BATCH_SIZE):
+            chunk = pending[chunk_start:chunk_start + cfg.CALENDAR_BATCH_SIZE]
+            bucket.acquire(len(chunk))
+            google_stats.add(requests=len(chunk))
+            batch = service.new_batch_http_request(callback=on_response)
+            for idx in chunk:
+                batch.add(calls[idx][1], request_id=str(idx))
+
+            try:
+                batch.execute()
+            except Exception as e:
+                # The whole batch request failed (network, auth...) - none of its requests went through
+                logger.error(f"Batch request failed: {e}")
+                for idx in chunk:
+                    errors[idx] = e
+
+        retry = []
+        retry_after = None
+        for idx in pending:
+            error = errors[idx]
+            if error is not None and attempt > 0 and google_error_status(error) in (409, 410):
+                # 409 on a retried insert / 410 on a retried delete: the earlier attempt went through
+                errors[idx] = error = None
+            if error is not None and is_transient_google_error(error) and attempt + 1 < cfg.RETRY_MAX_ATTEMPTS:
+                google_stats.add(transient_errors=1)
+                retry.append(idx)
+                retry_after = max(retry_after or 0, google_retry_after(error) or 0)
+                continue
+
+            label = calls[idx][0]
+            if error is None:
+                logger.info(f"Calendar request done: {label}")
+            else:
+                google_stats.add(permanent_errors=1)
+                logger.error(f"Calendar request failed: {label}: {error}")
+            done += 1
+            if on_progress:
+                on_progress(done, len(calls))
+
+        if retry:
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning(f"{len(retry)} calendar requests failed temporarily, retrying in {delay:.1f}s")
+            google_stats.add(retries=len(retry), backoff_seconds=delay)
+            time.sleep(delay)
+        pending = retry
+        attempt += 1
+
+    return errors
+
+
+# --- Idempotent week commits ---
+# Every generated event gets a deterministic ID derived from its day and slot type,
+# and is tagged (extendedProperties.private) with the day it belongs to ("anchor").
+# A commit lists the bot's events over the week once, and sends only the
+# inserts / patches / deletes needed to make the calendar match the plan.
+
+def tag_event(event, anchor_date, slot):
+    """Adds the deterministic ID and the bot's private properties to an event body."""
+    event['id'] = make_event_id(anchor_date, slot)
+    event['extendedProperties'] = {
+        'private': {
+            BOT_TAG: '1',
+            'hilalon_day': anchor_date.isoformat(),
+            'hilalon_slot': slot,
+        }
+    }
+    return event
 
-    # --- 1. Pickups (Sunday to Friday) ---
-    for day_idx in range(6):  # 0-5 (Sunday to Friday)
-        target_date = get_next_weekday(today, day_idx)
 
-        # Determine drivers
-        if day_idx in schedule_obj.hila_pickup_indices:
-            morning_driver = "הילה"
-            return_driver = "אלון"
-        else:
-            morning_driver = "אלון"
-            return_driver = "הילה"
+def _as_instant(when):
+    """Event start/end -> aware datetime, so '07:30 Asia/Jerusalem' equals '07:30+02:00'."""
+    dt = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = cfg.TIME_ZONE.localize(dt)
+    return dt
+
+
+def _fingerprint(event):
+    """The fields we control, normalized so a planned body compares equal to the API's version."""
+    reminders = event.get('reminders') or {}
+    return (
+        event.get('summary'),
+        event.get('description'),
+        _as_instant(event['start']),
+        _as_instant(event['end']),
+        event.get('colorId'),
+        tuple(sorted(r['minutes'] for r in reminders.get('overrides', []))),
+    )
+
+
+def list_bot_events(target, time_min, time_max):
+    """
+    One events.list call (plus pages, which a single week never needs)
+    returning the bot's events - including cancelled ones - in the range.
+    """
+    items = []
+    page_token = None
+    while True:
+        response = call_google(target.service.events().list(
+            calendarId=target.calendar_id,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            privateExtendedProperty=f"{BOT_TAG}=1",
+            showDeleted=True,
+            singleEvents=True,
+            maxResults=2500,
+            pageToken=page_token,
+        ), bucket=target.bucket)
+        items.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def _anchor_day(event):
+    """The day an existing bot event belongs to (ISO string)."""
+    if event.get('recurringEventId'):
+        # Instances of a pickup series belong to the day of the occurrence
+        return _as_instant(event['originalStartTime']).astimezone(cfg.TIME_ZONE).date().isoformat()
+    return event.get('extendedProperties', {}).get('private', {}).get('hilalon_day')
+
+
+def diff_week(planned, existing, window_days):
+    """
+    Computes the changes needed to make the calendar match the plan.
+    planned: event bodies (tagged), existing: events returned by list_bot_events,
+    window_days: the set of anchor dates (ISO strings) this plan is authoritative for.
 
-        # --- A. Create morning pickup event ---
-        start_iso = f"{target_date}T{cfg.DRIVE_START_TIME}"
-        end_iso = f"{target_date}T{cfg.DRIVE_END_TIME}"
+    Returns (inserts, patches, deletes, unchanged_count):
+    inserts - bodies, patches - (event_id, body), deletes - (event_id, summary).
+    """
+    existing_by_id = {ev['id']: ev for ev in existing}
+    planned_ids = set()
+    inserts, patches, deletes = [], [], []
+    unchanged = 0
+
+    for event in planned:
+        planned_ids.add(event['id'])
+        current = existing_by_id.get(event['id'])
+        if current is None:
+            inserts.append(event)
+        elif current.get('status') == 'cancelled':
+            # A deleted event keeps its ID - bring it back instead of inserting
+            patches.append((event['id'], dict(event, status='confirmed')))
+        elif _fingerprint(current) != _fingerprint(event):
+            patches.append((event['id'], event))
+        else:
+            unchanged += 1
 
-        dt_start = datetime.datetime.fromisoformat(start_iso)
-        dt_end = datetime.datetime.fromisoformat(end_iso)
+    for current in existing:
+        if current['id'] in planned_ids or current.get('status') == 'cancelled':
+            continue
+        if _anchor_day(current) in window_days:
+            # For an instance of a recurring series this cancels just that occurrence
+            deletes.append((current['id'], current.get('summary')))
 
-        create_event(service, f"🎒 {morning_driver} על אלה וקימל", "Created by HilAlon Bot", dt_start, dt_end, color_id=cfg.COLOR_ID)
-        created_count += 1
+    return inserts, patches, deletes, unchanged
 
-        # --- B. Create return event (afternoon) ---
-        # Set return times (using RETURN_START_TIME)
-        return_start_time = cfg.RETURN_START_TIME
-        return_end_time = cfg.RETURN_END_TIME
 
-        # If Friday has a shorter day (different from 16:30), add logic here:
-        if day_idx == 5:
-           return_start_time = cfg.FRIDAY_RETURN_START_TIME
-           return_end_time = cfg.FRIDAY_RETURN_END_TIME
+# --- Recurring pickup series (cfg.PICKUP_MODE == "recurring") ---
+# Instead of 12 one-off pickup events a week, every pickup slot (morning / return x Sunday-Friday)
+# is one weekly RRULE series with the default drivers. A week's choices become overrides of
+# single instances, so a typical week is a handful of instance patches.
 
-        return_start_iso = f"{target_date}T{return_start_time}"
-        return_end_iso = f"{target_date}T{return_end_time}"
+SERIES_DAYS = ["SU", "MO", "TU", "WE", "TH", "FR"]
+# Shown for changes of a series itself (their bodies carry no title)
+SERIES_TITLE = "🔁 סדרת איסופים"
 
-        dt_return_start = datetime.datetime.fromisoformat(return_start_iso)
-        dt_return_end = datetime.datetime.fromisoformat(return_end_iso)
 
-        # Create the event
-        create_event(service, f"🏠 {return_driver} על אלה וקימל", "Created by HilAlon Bot", dt_return_start, dt_return_end, color_id=cfg.COLOR_ID)
-        created_count += 1
+def series_event_id(slot, day_idx):
+    return hashlib.sha1(f"{BOT_TAG}:series:{slot}:{day_idx}".encode()).hexdigest()
 
-    # --- 2. Hila's date night + reminder ---
-    if schedule_obj.hila_date_index is not None:
-        date_day = get_next_weekday(today, schedule_obj.hila_date_index)
 
-        # A. Create date night event
-        dt_start = datetime.datetime.fromisoformat(f"{date_day}T{cfg.DATENIGHT_START_TIME}")
-        dt_end = datetime.datetime.fromisoformat(f"{date_day}T{cfg.DATENIGHT_END_TIME}")
+def instance_event_id(series_id, start_dt):
+    """ID of one occurrence: <series id>_<original start (aware) in UTC, basic format>."""
+    start_utc = start_dt.astimezone(pytz.utc)
+    return f"{series_id}_{start_utc:%Y%m%dT%H%M%SZ}"
 
-        create_event(service, "🍷 דייט הילה", "Created by HilAlon Bot", dt_start, dt_end, color_id=cfg.COLOR_ID, reminder_minutes=[60])
-        created_count += 1
 
-        reminder_date = date_day - datetime.timedelta(days=cfg.BABYSITTER_REMINDER_DAYS_BEFORE)  # 3 days
+def build_series_body(default_event, slot, day_idx):
+    """A weekly series starting at this occurrence, with the default drivers."""
+    series = dict(default_event)
+    series['id'] = series_event_id(slot, day_idx)
+    series['recurrence'] = [f"RRULE:FREQ=WEEKLY;BYDAY={SERIES_DAYS[day_idx]}"]
+    series['extendedProperties'] = {
+        'private': {
+            BOT_TAG: '1',
+            'hilalon_series': f"{slot}:{day_idx}",
+        }
+    }
+    return series
 
-        rem_start = f"{reminder_date}T{cfg.BABYSITTER_REMINDER_START_TIME}"
-        rem_end = f"{reminder_date}T{cfg.BABYSITTER_REMINDER_END_TIME}"
 
-        dt_rem_start = datetime.datetime.fromisoformat(rem_start)
-        dt_rem_end = datetime.datetime.fromisoformat(rem_end)
+def end_series_changes(existing, until):
+    """
+    Back in single pickup mode, the series left from recurring mode must stop producing
+    default pickups. Every series with a live occurrence among `existing` is ended just before
+    `until` (the start of the committed weeks) by adding UNTIL to its RRULE - its occurrences
+    from then on disappear with it, and the ones before stay as history.
+    Returns (changes, undo changes, IDs of the ended series).
+    """
+    weekdays = {}
+    for event in existing:
+        series_id = event.get('recurringEventId')
+        if series_id and event.get('status') != 'cancelled':
+            start = _as_instant(event['originalStartTime']).astimezone(cfg.TIME_ZONE)
+            weekdays[series_id] = SERIES_DAYS[(start.weekday() + 1) % 7]
+    until_utc = until.astimezone(pytz.utc)
+    changes = [('patch', series_id, {'recurrence': [f"RRULE:FREQ=WEEKLY;BYDAY={day};UNTIL={until_utc:%Y%m%dT%H%M%SZ}"]})
+               for series_id, day in weekdays.items()]
+    undo = [('patch', series_id, {'recurrence': [f"RRULE:FREQ=WEEKLY;BYDAY={day}"]})
+            for series_id, day in weekdays.items()]
+    return changes, undo, set(weekdays)
+
+
+@dataclass
+class PickupPlan:
+    """
+    instances - planned bodies keyed by instance ID, to be diffed like any other event,
+    fallbacks - one-off events for slots whose series could not be created,
+    created_instances - the occurrences the new series just produced (their current state),
+    created_series - (series ID, title) of the series this plan created.
+    """
+    instances: list
+    fallbacks: list
+    created_instances: list
+    series_sent: int = 0
+    series_created: int = 0
+    created_series: list = field(default_factory=list)
 
-        create_event(
-            service,
-            "⏰ בייביסיטר: הילה דואגת",
-            "Created by HilAlon Bot",
-            dt_rem_start,
-            dt_rem_end,
-            color_id=cfg.COLOR_ID,
-            reminder_minutes=[0]
-        )
-        created_count += 1
 
-    # --- 3. Alon's date night + reminder ---
-    if schedule_obj.alon_date_index is not None:
-        date_day = get_next_weekday(today, schedule_obj.alon_date_index)
+def plan_pickup_instances(target, existing, pickups):
+    """
+    pickups: list of (slot, day_idx, target_date, default_event, planned_event).
+    Creates the series that have no occurrence on the calendar yet (one batch)
+    and returns a PickupPlan.
+    """
+    existing_ids = {ev['id'] for ev in existing}
+    events_api = target.service.events()
+
+    def occurrence_id(slot, day_idx, event):
+        return instance_event_id(series_event_id(slot, day_idx), _as_instant(event['start']))
+
+    # A series is created once, starting at its earliest missing occurrence;
+    # later weeks of the same series get their occurrences from it.
+    missing = [p for p in sorted(pickups, key=lambda p: p[2]) if occurrence_id(p[0], p[1], p[3]) not in existing_ids]
+    to_create = {}
+    for slot, day_idx, _date, default_event, _planned in missing:
+        to_create.setdefault((slot, day_idx), default_event)
+
+    series_keys = list(to_create)
+    calls = [(to_create[key]['summary'], events_api.insert(
+        calendarId=target.calendar_id, body=build_series_body(to_create[key], *key))) for key in series_keys]
+    errors = execute_batch(target.service, calls, bucket=target.bucket) if calls else []
+    failed = {key for key, err in zip(series_keys, errors) if err is not None}
+
+    created_instances = []
+    fallback_ids = set()
+    for slot, day_idx, _date, default_event, _planned in missing:
+        if (slot, day_idx) in failed:
+            fallback_ids.add(occurrence_id(slot, day_idx, default_event))
+        else:
+            created_instances.append(dict(
+                default_event,
+                id=occurrence_id(slot, day_idx, default_event),
+                status='confirmed',
+            ))
+
+    instance_events = []
+    fallback_events = []
+    for slot, day_idx, target_date, _default, planned_event in pickups:
+        instance_id = occurrence_id(slot, day_idx, planned_event)
+        if instance_id in fallback_ids:
+            logger.warning(f"Pickup series {slot}:{day_idx} unavailable - using a one-off event")
+            fallback_events.append(tag_event(dict(planned_event), target_date, slot))
+        else:
+            instance_events.append(dict(planned_event, id=instance_id))
 
-        # A. Create date night event
-        dt_start = datetime.datetime.fromisoformat(f"{date_day}T{cfg.DATENIGHT_START_TIME}")
-        dt_end = datetime.datetime.fromisoformat(f"{date_day}T{cfg.DATENIGHT_END_TIME}")
+    created_series = [(series_event_id(*key), to_create[key]['summary']) for key in series_keys if key not in failed]
+    return PickupPlan(instance_events, fallback_events, created_instances,
+                      series_sent=len(series_keys), series_created=len(created_series),
+                      created_series=created_series)
 
-        create_event(service, "🍺 דייט אלון", "Created by HilAlon Bot", dt_start, dt_end, color_id=cfg.COLOR_ID, reminder_minutes=[60])
-        created_count += 1
 
-        # B. Create babysitter reminder (3 days before)
-        reminder_date = date_day - datetime.timedelta(days=cfg.BABYSITTER_REMINDER_DAYS_BEFORE)  # 3 days
+# A change is ('insert', event_id, body), ('patch', event_id, body) or ('delete', event_id, title).
+# Changes are plain tuples, so the ones that undo a commit can be kept in the household's state.
 
-        rem_start = f"{reminder_date}T{cfg.BABYSITTER_REMINDER_START_TIME}"
-        rem_end = f"{reminder_date}T{cfg.BABYSITTER_REMINDER_END_TIME}"
+def _change_title(change):
+    kind, _event_id, data = change
+    return data if kind == 'delete' else data.get('summary', SERIES_TITLE)
 
-        dt_rem_start = datetime.datetime.fromisoformat(rem_start)
-        dt_rem_end = datetime.datetime.fromisoformat(rem_end)
 
-        create_event(
-            service,
-            "⏰ בייביסיטר: אלון דואג",
-            "Created by HilAlon Bot",
-            dt_rem_start,
-            dt_rem_end,
-            color_id=cfg.COLOR_ID,
-            reminder_minutes=[0]
-        )
-        created_count += 1
+def _change_request(events_api, calendar_id, change):
+    kind, event_id, data = change
+    if kind == 'insert':
+        return events_api.insert(calendarId=calendar_id, body=data)
+    if kind == 'patch':
+        return events_api.patch(calendarId=calendar_id, eventId=event_id, body=data)
+    return events_api.delete(calendarId=calendar_id, eventId=event_id)
 
-    # --- 4. Kimel to kindergarten ---
-    kimel_counter = bot_data.get(cfg.KIMEL_COUNTER_KEY, cfg.KIMEL_INITIAL_COUNT)
 
-    for day_idx in schedule_obj.kimel_indices:
-        target_date = get_next_weekday(today, day_idx)
+def send_changes(target, changes, on_progress=None):
+    """Sends changes in paced batches (execute_batch). Returns the errors, aligned with `changes`."""
+    if not changes:
+        return []
+    events_api = target.service.events()
+    calls = [(_change_title(change), _change_request(events_api, target.calendar_id, change)) for change in changes]
+    return execute_batch(target.service, calls, on_progress=on_progress, bucket=target.bucket)
 
-        # Update the title with current counter
-        title = f"🧸 קימל בגן מס' {kimel_counter}"
 
-        # Create Kimel event
-        start_iso = f"{target_date}T{cfg.KINDERGARTEN_START_TIME}"
-        end_iso = f"{target_date}T{cfg.KINDERGARTEN_END_TIME}"
-        dt_start = datetime.datetime.fromisoformat(start_iso)
-        dt_end = datetime.datetime.fromisoformat(end_iso)
+# The fields a commit writes, restored when a patch is undone
+_RESTORED_FIELDS = ('summary', 'description', 'start', 'end', 'colorId', 'reminders')
 
-        create_event(service, title, "Created by HilAlon Bot", dt_start, dt_end, color_id=cfg.COLOR_ID)
-        created_count += 1
 
+def compensation(change, previous):
+    """
+    The change that undoes `change`. previous is the event as it was before the change
+    (None for an insert). Deleted bot events keep their ID, so a delete is undone by a patch.
+    """
+    kind, event_id, data = change
+    if kind == 'insert' or previous.get('status') == 'cancelled':
+        return ('delete', event_id, data['summary'])
+    if kind == 'patch':
+        return ('patch', event_id, {name: previous.get(name) for name in _RESTORED_FIELDS})
+    return ('patch', event_id, {'summary': previous.get('summary'), 'status': 'confirmed'})
 
-        kimel_counter += 1
-        if kimel_counter > cfg.KIMEL_MAX_COUNT:
-            kimel_counter = cfg.KIMEL_RESET_COUNT  # Reset to 1 after reaching max
 
-    bot_data[cfg.KIMEL_COUNTER_KEY] = kimel_counter
+def sync_week(target, planned, window_days, time_min, time_max, on_progress=None, pickups=None, atomic=False,
+              series_until=None):
+    """
+    Makes the calendar match `planned` with one list call and one batch of changes.
+    pickups (recurring mode only) are handled as overrides of the pickup series.
+    series_until (single mode) is where series left from recurring mode end - the start of the
+    first committed week; time_min reaches a few days earlier, for the reminders.
+    Works the same for several weeks at once - window_days and the time range just cover them all.
+
+    atomic=True makes the sync all-or-nothing: changes that failed are sent once more, and if
+    some still fail, everything that went through is taken back in one batch.
+    Returns a SyncReport.
+    """
+    existing = list_bot_events(target, time_min, time_max)
+
+    series_created = series_requests = 0
+    created_series = []
+    series_changes, series_undo = [], []
+    if pickups:
+        plan = plan_pickup_instances(target, existing, pickups)
+        planned = planned + plan.instances + plan.fallbacks
+        existing = existing + plan.created_instances
+        series_created, series_requests = plan.series_created, plan.series_sent
+        created_series = plan.created_series
+    else:
+        # Single pickup mode: end the series left from recurring mode instead of cancelling their
+        # occurrences week by week (which would leave them producing pickups in every other week)
+        series_changes, series_undo, ended = end_series_changes(existing, series_until or time_min)
+        if ended:
+            logger.info(f"Ending {len(ended)} pickup series left from recurring mode")
+            existing = [event for event in existing if event.get('recurringEventId') not in ended]
+
+    inserts, patches, deletes, unchanged = diff_week(planned, existing, window_days)
+    changes = ([('insert', event['id'], event) for event in inserts]
+               + [('patch', event_id, event) for event_id, event in patches]
+               + [('delete', event_id, summary) for event_id, summary in deletes]
+               + series_changes)
+
+    errors = send_changes(target, changes, on_progress=on_progress)
+    requests = 1 + series_requests + len(changes)
+    failed = {i for i, err in enumerate(errors) if err is not None}
+    if atomic and failed:
+        # Retry only the changes that are missing
+        retry = sorted(failed)
+        logger.warning(f"Atomic commit: retrying {len(retry)} failed changes")
+        retry_errors = send_changes(target, [changes[i] for i in retry])
+        requests += len(retry)
+        failed = {i for i, err in zip(retry, retry_errors) if err is not None}
+
+    # Undoing a new series deletes all of its occurrences, so they need no change of their own
+    existing_by_id = {event['id']: event for event in existing}
+    new_series_prefixes = tuple(f"{series_id}_" for series_id, _title in created_series)
+    series_undo_by_id = {change[1]: change for change in series_undo}
+    undo = [series_undo_by_id.get(change[1]) or compensation(change, existing_by_id.get(change[1]))
+            for i, change in reversed(list(enumerate(changes)))
+            if i not in failed and not (new_series_prefixes and change[1].startswith(new_series_prefixes))]
+    undo += [('delete', series_id, title) for series_id, title in created_series]
+
+    report = SyncReport(
+        inserted=len(inserts) + series_created,
+        updated=len(patches) + len(series_changes),
+        deleted=len(deletes),
+        unchanged=unchanged,
+        failed=[_change_title(changes[i]) for i in sorted(failed)],
+        requests=requests,
+        undo=undo,
+    )
+
+    if atomic and failed and undo:
+        logger.warning(f"Atomic commit: {len(failed)} changes failed, rolling back {len(undo)}")
+        rollback_errors = send_changes(target, undo)
+        report.requests += len(undo)
+        report.rolled_back = True
+        report.undo = []
+        report.rollback_failed = [_change_title(change) for change, err in zip(undo, rollback_errors) if err is not None]
+    elif atomic and failed:
+        report.rolled_back = True
+    return report
+
+
+def spec_to_event(spec, summary=None):
+    """EventSpec -> Calendar event body (optionally with a different title)."""
+    return build_event_body(summary or spec.summary, spec.description, spec.start, spec.end,
+                            color_id=spec.color_id, reminder_minutes=spec.reminders)
+
+
+class GoogleBackend(CalendarBackend):
+    """Syncs the planned events to a Google Calendar (a CalendarTarget)."""
+
+    def __init__(self, target):
+        self.target = target
+
+    def write_weeks(self, specs, window_starts, on_progress=None):
+        """
+        One list call over the whole range and paced batches of changes (sync_week).
+        In recurring pickup mode, pickups become overrides of the pickup series.
+        """
+        events = []
+        pickups = []
+        recurring = cfg.PICKUP_MODE == "recurring"
+        for spec in specs:
+            event = spec_to_event(spec)
+            if recurring and spec.default_summary:
+                # The series carries the default drivers - this week's choice becomes an instance override
+                pickups.append((spec.slot, spec.day_index, spec.anchor_date,
+                                spec_to_event(spec, spec.default_summary), event))
+            else:
+                events.append(tag_event(event, spec.anchor_date, spec.slot))
+
+        window_days = {day.isoformat() for start in window_starts for day in week_context(start).dates}
+        time_min = week_context(min(window_starts)).time_min
+        time_max = week_context(max(window_starts)).time_max
+        first_day = cfg.TIME_ZONE.localize(datetime.datetime.combine(min(window_starts), datetime.time.min))
+
+        return sync_week(self.target, events, window_days, time_min, time_max, on_progress=on_progress,
+                         pickups=pickups, atomic=cfg.COMMIT_MODE == "atomic", series_until=first_day)
+
+
+def undo_last_commit(tenant, state, on_progress=None):
+    """
+    Takes back a household's last commit - deletes the events it created and restores
+    the ones it changed or deleted - in one batch, and restores the Kimel counter.
+    Changes that could not be undone are kept, so undoing again retries just those.
+    Returns (weeks of the commit, SyncReport), or None if there is nothing to undo.
+    """
+    with kimel_lock:
+        last = state.pop(cfg.LAST_COMMIT_KEY, None)
+        if last is None:
+            return None
+        if 'kimel' in last:
+            restore_kimel(state, last['kimel'])
+
+    errors = send_changes(calendar_target(tenant), last['undo'], on_progress=on_progress)
+    report = SyncReport(
+        updated=sum(1 for kind, _event_id, _data in last['undo'] if kind == 'patch'),
+        deleted=sum(1 for kind, _event_id, _data in last['undo'] if kind == 'delete'),
+        failed=[_change_title(change) for change, err in zip(last['undo'], errors) if err is not None],
+        requests=len(last['undo']),
+    )
+    remaining = [change for change, err in zip(last['undo'], errors) if err is not None]
+    if remaining:
+        with kimel_lock:
+            state.setdefault(cfg.LAST_COMMIT_KEY, {'weeks': last['weeks'], 'undo': remaining})
+    return last['weeks'], report
+
+
+async def run_calendar_job(func, *args, on_progress=None):
+    """
+    Runs a blocking calendar function in the bounded calendar executor.
+    func receives on_progress as a keyword argument; the callback given here
+    is called back on the event loop thread, so it may touch asyncio objects.
+    """
+    loop = asyncio.get_running_loop()
+
+    def progress_from_worker(done, total):
+        if on_progress:
+            loop.call_soon_threadsafe(on_progress, done, total)
+
+    return await loop.run_in_executor(
+        _calendar_executor,
+        functools.partial(func, *args, on_progress=progress_from_worker)
+    )
+
+
+def format_undo_message(weeks, report):
+    """Builds the message shown after /undo."""
+    weeks_txt = ", ".join(datetime.date.fromisoformat(week).strftime('%d/%m') for week in weeks)
+    weeks_txt = f"שבוע שמתחיל ב-{weeks_txt}" if len(weeks) == 1 else f"שבועות שמתחילים ב-{weeks_txt}"
+    if not report.failed:
+        return (
+            f"↩️ הפעולה האחרונה בוטלה ({weeks_txt}).\n"
+            f"🗑 נמחקו: {report.deleted} | ♻️ שוחזרו: {report.updated}"
+        )
 
-    return f"✅ הסתיים בהצלחה! נוצרו {created_count} אירועים ביומן."
\ No newline at end of file
+    failed_txt = "\n".join(f"• {label}" for label in report.failed)
+    return (
+        f"⚠️ הביטול הצליח בחלקו ({report.deleted + report.updated - len(report.failed)} מתוך "
+        f"{report.deleted + report.updated}).\nלא בוטלו:\n{failed_txt}\nשלחו /undo שוב כדי לנסות שוב."
+    )
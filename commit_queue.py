@@ -0,0 +1,330 @@
+import asyncio
+import copy
+import datetime
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from telegram.error import TelegramError
+import config as cfg
+from schedule_logic import WeeklySchedule
+from tenants import tenant_state, tenants
+from throttling import backoff_delay
+from latency_stats import percentile
+from startup import load_calendar
+from commit_scheduler import run_commit, run_undo
+from calendar_mirror import calendar_mirror, sync_tenant_async
+
+logger = logging.getLogger(__name__)
+
+# --- Durable commit jobs ---
+# A confirmation doesn't write to the calendar itself: it stores a commit job in a SQLite
+# table and is acknowledged right away. A small pool of workers drains the table and
+# sends the result as a follow-up message. Jobs that were running when the process died
+# are picked up again on the next start - commits are idempotent, so re-running one
+# only writes what is still missing.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commit_jobs (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued / running / done / failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS commit_jobs_status ON commit_jobs (status, not_before, enqueued_at);
+"""
+
+
+class CommitQueue:
+    """
+    The commit_jobs table. All methods are blocking (short SQLite transactions) -
+    call them with asyncio.to_thread from the event loop.
+    A household's jobs run one at a time, oldest first - a job waiting for its retry also holds
+    back the newer ones - so its commits and undos stay in order.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # Jobs that were running when the process stopped start over
+            recovered = self._conn.execute(
+                "UPDATE commit_jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            if recovered:
+                logger.info(f"Re-queued {recovered} interrupted commit job(s)")
+        return self._conn
+
+    def enqueue(self, tenant_id, chat_id, schedules, window_starts, message_id=None):
+        return self._insert(tenant_id, chat_id, message_id, {
+            'kind': 'commit',
+            'schedules': [s.to_dict() for s in schedules],
+            'window_starts': [d.isoformat() for d in window_starts],
+        })
+
+    def enqueue_undo(self, tenant_id, chat_id, message_id=None):
+        """An undo of the household's last commit - queued like a commit, so it runs after the ones before it."""
+        return self._insert(tenant_id, chat_id, message_id, {'kind': 'undo'})
+
+    def _insert(self, tenant_id, chat_id, message_id, payload):
+        job_id = uuid.uuid4().hex
+        payload = json.dumps(payload)
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO commit_jobs (id, tenant_id, chat_id, message_id, payload, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, tenant_id, chat_id, message_id, payload, time.time()))
+        return job_id
+
+    def claim(self):
+        """
+        Marks the oldest runnable job as running and returns it (a dict), or None.
+        Only the oldest queued job of a household can run, and only once its retry is due.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, tenant_id, chat_id, message_id, payload, attempts, enqueued_at FROM commit_jobs AS job "
+                    "WHERE status = 'queued' AND not_before <= ? AND tenant_id NOT IN "
+                    "(SELECT tenant_id FROM commit_jobs WHERE status = 'running') AND NOT EXISTS "
+                    "(SELECT 1 FROM commit_jobs AS older WHERE older.tenant_id = job.tenant_id "
+                    "AND older.status = 'queued' AND older.enqueued_at < job.enqueued_at) "
+                    "ORDER BY enqueued_at LIMIT 1", (time.time(),)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE commit_jobs SET status = 'running', attempts = attempts + 1, "
+                                 "started_at = ? WHERE id = ?", (time.time(), row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        job_id, tenant_id, chat_id, message_id, payload, attempts, enqueued_at = row
+        data = json.loads(payload)
+        return {
+            'id': job_id,
+            'tenant_id': tenant_id,
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'kind': data.get('kind', 'commit'),
+            'schedules': [WeeklySchedule.from_dict(d) for d in data.get('schedules', ())],
+            'window_starts': [datetime.date.fromisoformat(d) for d in data.get('window_starts', ())],
+            'attempts': attempts + 1,
+            'enqueued_at': enqueued_at,
+        }
+
+    def finish(self, job_id, status, result=None):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE commit_jobs SET status = ?, finished_at = ?, result = ? WHERE id = ?",
+                (status, time.time(), result, job_id))
+
+    def retry_later(self, job_id, delay):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE commit_jobs SET status = 'queued', not_before = ? WHERE id = ?",
+                (time.time() + delay, job_id))
+
+    def prune(self, keep_days=30):
+        """Deletes finished jobs older than keep_days."""
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM commit_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - keep_days * 86400,))
+
+    def stats(self, recent=200):
+        """Queue depth by status, and wait / total latency (seconds) of the most recent finished jobs."""
+        with self._lock:
+            conn = self._connect()
+            depth = dict(conn.execute("SELECT status, COUNT(*) FROM commit_jobs "
+                                      "WHERE status IN ('queued', 'running') GROUP BY status").fetchall())
+            rows = conn.execute("SELECT started_at - enqueued_at, finished_at - enqueued_at FROM commit_jobs "
+                                "WHERE status IN ('done', 'failed') ORDER BY finished_at DESC LIMIT ?",
+                                (recent,)).fetchall()
+
+        def percentiles(values):
+            if not values:
+                return None
+            return {'p50_s': round(percentile(values, 0.5), 2), 'p99_s': round(percentile(values, 0.99), 2)}
+
+        return {
+            'queued': depth.get('queued', 0),
+            'running': depth.get('running', 0),
+            'wait': percentiles([r[0] for r in rows]),
+            'total': percentiles([r[1] for r in rows]),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+commit_jobs = CommitQueue(cfg.COMMIT_QUEUE_FILE)
+
+
+class CommitProgress:
+    """
+    Shows the progress of a commit job by editing its status message.
+    update() may be called for every event; the message itself is edited
+    at most once per cfg.PROGRESS_EDIT_INTERVAL so we stay within Telegram's limits.
+    """
+
+    def __init__(self, bot, chat_id, message_id, base_text):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.base_text = base_text
+        self.latest = None
+        self.shown = None
+        self._task = None
+
+    def update(self, done, total):
+        if self.message_id is None:
+            return
+        self.latest = (done, total)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._render())
+
+    async def _render(self):
+        while self.latest != self.shown:
+            current = self.latest
+            done, total = current
+            try:
+                await self.bot.edit_message_text(
+                    f"{self.base_text}\n⏳ {done}/{total} אירועים", chat_id=self.chat_id, message_id=self.message_id)
+            except TelegramError as e:
+                logger.debug(f"Progress edit skipped: {e}")
+            self.shown = current
+            await asyncio.sleep(cfg.PROGRESS_EDIT_INTERVAL)
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+
+# --- Workers ---
+
+_wake = asyncio.Event()
+
+
+def notify_workers():
+    """Wakes an idle worker (call after enqueueing, on the event loop)."""
+    _wake.set()
+
+
+async def _run_job(application, job):
+    tenant = tenants.get(job['tenant_id'])
+    if tenant is None:
+        await asyncio.to_thread(commit_jobs.finish, job['id'], 'failed', "unknown household")
+        logger.error(f"Commit job {job['id']}: household {job['tenant_id']} no longer exists")
+        return
+
+    weeks = len(job['schedules'])
+    state = tenant_state(application.bot_data, tenant)
+    # The calendar thread works on a copy of the household's state, which is put back here on
+    # the event loop - the persistence runs copy bot_data there too, so they never see it change
+    working = copy.deepcopy(state)
+    if job['kind'] == 'undo':
+        base_text = "↩️ מבטל את הפעולה האחרונה..."
+        func, args = run_undo, (tenant, working)
+    else:
+        base_text = "🚀 יוצר אירועים ביומן..." if weeks == 1 else f"📆 יוצר אירועים ל-{weeks} שבועות..."
+        # The job ID ties the attempts of the job together in the household's undo
+        func = functools.partial(run_commit, commit_id=job['id'])
+        args = (tenant, job['schedules'], job['window_starts'], working)
+    progress = CommitProgress(application.bot, job['chat_id'], job['message_id'], base_text)
+    try:
+        calendar = await load_calendar()
+        text, complete = await calendar.run_calendar_job(func, *args, on_progress=progress.update)
+        state.clear()
+        state.update(working)
+    except Exception as e:
+        text, complete = f"❌ שגיאה ביצירת אירועים: {e}", False
+        logger.error(f"Commit job {job['id']} failed (attempt {job['attempts']}): {e}")
+    finally:
+        await progress.close()
+        # Store the advanced Kimel counter now rather than at the next persistence run
+        await application.update_persistence()
+
+    if cfg.CALENDAR_BACKEND == "google":
+        try:
+            # The calendar just changed - bring its mirror up to date (one incremental list call)
+            await sync_tenant_async(tenant)
+        except Exception as e:
+            logger.error(f"Calendar mirror sync after job {job['id']} failed: {e}")
+
+    if not complete and job['attempts'] < cfg.COMMIT_JOB_MAX_ATTEMPTS:
+        await asyncio.to_thread(commit_jobs.retry_later, job['id'], backoff_delay(job['attempts'], 5))
+        return
+
+    await asyncio.to_thread(commit_jobs.finish, job['id'], 'done' if complete else 'failed', text)
+    latency = time.time() - job['enqueued_at']
+    logger.info(f"Commit job {job['id']} ({tenant.tenant_id}) finished in {latency:.1f}s after enqueueing")
+    try:
+        await application.bot.send_message(chat_id=job['chat_id'], text=text)
+    except TelegramError as e:
+        logger.error(f"Could not report commit job {job['id']}: {e}")
+
+
+async def _worker(application, name):
+    while application.running:
+        try:
+            job = await asyncio.to_thread(commit_jobs.claim)
+        except Exception:
+            logger.exception(f"{name}: could not claim a commit job")
+            await asyncio.sleep(cfg.COMMIT_QUEUE_POLL_INTERVAL)
+            continue
+        if job is None:
+            _wake.clear()
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=cfg.COMMIT_QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        logger.info(f"{name}: commit job {job['id']} ({job['tenant_id']}, attempt {job['attempts']})")
+        try:
+            await _run_job(application, job)
+        except Exception:
+            # Bookkeeping failed (SQLite, persistence...) - keep the worker alive and the job retryable
+            logger.exception(f"{name}: commit job {job['id']} crashed")
+            try:
+                await asyncio.to_thread(commit_jobs.retry_later, job['id'], backoff_delay(job['attempts'], 5))
+            except Exception:
+                logger.exception(f"{name}: could not re-queue commit job {job['id']}")
+        _wake.set()  # a job of the same household may have been waiting for this one
+
+
+async def start_commit_workers(context):
+    """Job callback run once at startup: starts the workers that drain the commit queue."""
+    await asyncio.to_thread(commit_jobs.prune)
+    for i in range(cfg.COMMIT_WORKERS):
+        # Tasks of the application: Application.stop() waits for the job in progress
+        context.application.create_task(_worker(context.application, f"commit-worker-{i}"))
+
+
+async def close_stores(application):
+    """post_shutdown callback: logs the queue stats and closes the commit queue and mirror databases."""
+    logger.info(f"Commit queue: {commit_jobs.stats()}")
+    commit_jobs.close()
+    calendar_mirror.close()
@@ -0,0 +1,84 @@
+import datetime
+import logging
+import os
+import time
+import config as cfg
+from event_plan import current_week
+from calendar_backends import IcsBackend, MemoryBackend, commit_weeks_to, format_results_message
+from startup import calendar_module
+
+logger = logging.getLogger(__name__)
+
+# --- Commits of one or more weeks ---
+# A bulk plan covers several weeks in one session. Like a single week, it is committed as one
+# paced sync (calendar_utils throttles every request to cfg.CALENDAR_QPS) by a commit job
+# (see commit_queue.py), so a commit interrupted by a restart is finished when the bot comes back.
+# Commits go to the backend named by cfg.CALENDAR_BACKEND (see calendar_backends.py).
+
+
+def plan_weeks(schedule, weeks, alternate=False):
+    """
+    The schedules for `weeks` consecutive weeks, starting with `schedule`.
+    alternate=True flips every second week (see WeeklySchedule.alternated).
+    """
+    schedules = []
+    for i in range(weeks):
+        schedules.append(schedule.alternated() if alternate and i % 2 else schedule.copy())
+    return schedules
+
+
+def bulk_window_starts(weeks):
+    """The first day of each planned week - the first week starts tomorrow (Israel time)."""
+    first = current_week().window_start
+    return [first + datetime.timedelta(weeks=i) for i in range(weeks)]
+
+
+_memory_backends = {}  # tenant ID -> MemoryBackend (cfg.CALENDAR_BACKEND == "memory")
+
+
+def commit_backend(tenant, window_starts):
+    """The backend a household's commit goes to (cfg.CALENDAR_BACKEND)."""
+    if cfg.CALENDAR_BACKEND == "ics":
+        os.makedirs(cfg.ICS_EXPORT_DIR, exist_ok=True)
+        return IcsBackend(os.path.join(cfg.ICS_EXPORT_DIR, f"{tenant.tenant_id}-{window_starts[0].isoformat()}.ics"))
+    if cfg.CALENDAR_BACKEND == "memory":
+        return _memory_backends.setdefault(tenant.tenant_id, MemoryBackend())
+    calendar = calendar_module()
+    return calendar.GoogleBackend(calendar.calendar_target(tenant))
+
+
+def run_commit(tenant, schedules, window_starts, state, on_progress=None, commit_id=None):
+    """
+    Commits one or more weeks of a household (blocking).
+    Returns (text for the user, complete) - complete is False if some changes failed.
+    A multi-week commit also reports its throughput.
+    """
+    backend = commit_backend(tenant, window_starts)
+    started = time.monotonic()
+    report = commit_weeks_to(backend, tenant, schedules, window_starts, state, on_progress=on_progress,
+                             commit_id=commit_id)
+    elapsed = time.monotonic() - started
+
+    text = format_results_message(report)
+    if isinstance(backend, IcsBackend):
+        text += f"\n📄 {backend.destination}"
+    if len(schedules) > 1:
+        rate = report.changes / elapsed if elapsed else 0
+        logger.info(f"Bulk commit ({tenant.tenant_id}): {len(schedules)} weeks, {report.changes} changes, "
+                    f"{report.requests} requests in {elapsed:.1f}s ({rate:.1f} changes/s)")
+        text += (f"\n📆 {len(schedules)} שבועות | ⏱ {elapsed:.1f} שנ' | {report.requests} בקשות | "
+                 f"{rate:.1f} שינויים לשנייה")
+    return text, not report.failed
+
+
+def run_undo(tenant, state, on_progress=None):
+    """Takes back the household's last commit (blocking). Returns (text for the user, complete)."""
+    if cfg.LAST_COMMIT_KEY not in state:
+        return "אין פעולה לבטל.", True
+    calendar = calendar_module()
+    result = calendar.undo_last_commit(tenant, state, on_progress=on_progress)
+    if result is None:
+        return "אין פעולה לבטל.", True
+    weeks, report = result
+    logger.info(f"Undo ({tenant.tenant_id}): {report.changes} changes, {len(report.failed)} failed")
+    return calendar.format_undo_message(weeks, report), not report.failed
@@ -16,6 +16,31 @@ REMINDER_HOUR = 20  # 20:00 (8 PM)
 REMINDER_MINUTE = 0
 REMINDER_DAY_OF_WEEK = 3  # 0=Mon, 1=Tue, 2=Wed, 3=Thu, 4=Fri, 5=Sat, 6=Sun (APScheduler format)
 
+# How updates are received:
+# "polling" - long polling (default)
+# "webhook" - Telegram posts updates to the bot's own HTTP server (see webhook_server.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook server. The webhook is registered with Telegram only when WEBHOOK_URL is set
+# (the public HTTPS base URL, e.g. behind a reverse proxy); without it the server just listens.
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Sent by Telegram in the X-Telegram-Bot-Api-Secret-Token header; requests without it are rejected.
+# Required when WEBHOOK_URL is set.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Larger update bodies are refused (413) without being read
+WEBHOOK_MAX_BODY = 1024 * 1024
+HEALTH_PATH = "/healthz"
+
+# Updates processed at the same time. Updates of one user are still handled one by one, in order.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))
+
+# Households served by this bot (see tenants.py). Without this file the bot serves one
+# household: CALENDAR_ID below, with the users in ADMIN_CHAT_ID as its members.
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+
 # --- 2. GOOGLE CALENDAR SETTINGS ---
 # Credentials file created after Google Cloud registration
 
@@ -28,9 +53,69 @@ def resource_path(rel):
 
 CALENDAR_CREDENTIALS_FILE = resource_path("credentials.json")
 
+# OAuth token saved after the first authorization
+TOKEN_FILE = "token.json"
+
+# The token is refreshed in the background when it expires within this many seconds
+TOKEN_REFRESH_MARGIN = 10 * 60
+TOKEN_REFRESH_CHECK_INTERVAL = 5 * 60
+
 # ⚠️ Required environment variable (CALENDAR_ID)
 CALENDAR_ID = os.getenv("CALENDAR_ID", "enter_your_calendar_id_here")
 
+# Where commits are written: "google" (default), "ics" (an .ics file per commit in ICS_EXPORT_DIR,
+# no network - for exports and dry runs) or "memory" (kept in the process, for tests and benchmarks)
+CALENDAR_BACKEND = os.getenv("CALENDAR_BACKEND", "google")
+ICS_EXPORT_DIR = os.getenv("ICS_EXPORT_DIR", "exports")
+
+# Local stand-ins of the APIs (benchmarks/): e.g. GOOGLE_API_ENDPOINT=http://127.0.0.1:8081/
+# and TELEGRAM_API_URL=http://127.0.0.1:8082. Empty means the real services.
+GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT", "")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Maximum number of calls in a single Calendar API batch request
+CALENDAR_BATCH_SIZE = 50
+
+# Calendar requests per second we allow ourselves (stays well under Google's per-user quota).
+# Every sub-request of a batch counts as one request.
+CALENDAR_QPS = 5
+
+# Telegram requests per second we allow ourselves (Telegram allows about 30 messages per second)
+TELEGRAM_RPS = float(os.getenv("TELEGRAM_RPS", "25"))
+
+# Retries of transient API errors (rate limits, 5xx, network): exponential backoff with jitter
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5  # seconds
+RETRY_MAX_DELAY = 30  # seconds
+
+# Seconds after startup to load the Google client libraries in the background
+# (negative: load them only when the first schedule is confirmed - until then the calendar
+# mirror isn't synced, and conflict checks use what it held when the bot stopped)
+CALENDAR_WARMUP_DELAY = float(os.getenv("CALENDAR_WARMUP_DELAY", "2"))
+
+# Worker threads for the blocking Calendar calls (bounded, so a burst of confirmations can't flood Google)
+CALENDAR_WORKERS = 2
+
+# Multi-week (bulk) planning
+BULK_WEEKS = 4  # Number of weeks a bulk plan covers
+
+# Confirmed schedules are committed by background workers from a durable queue (SQLite)
+COMMIT_QUEUE_FILE = "commit_jobs.sqlite3"
+COMMIT_WORKERS = CALENDAR_WORKERS
+COMMIT_JOB_MAX_ATTEMPTS = 3  # a job whose changes partly failed is retried (with backoff) up to this many times
+COMMIT_QUEUE_POLL_INTERVAL = 2.0  # seconds an idle worker waits before checking for delayed retries
+
+# Local mirror of the households' calendars (SQLite), kept current with incremental syncs
+MIRROR_FILE = "calendar_mirror.sqlite3"
+MIRROR_SYNC_INTERVAL = 300  # seconds between background syncs (a commit also syncs its calendar)
+
+# Planned slots checked against the existing calendar in the summary step
+CONFLICT_SLOTS = ("morning", "return", "date_hila", "date_alon")
+CONFLICT_CHECK_TIMEOUT = 3  # seconds for the sync before the check; if Google is slower, the last synced copy is used
+
+# Minimum seconds between two progress edits of the "creating events" message
+PROGRESS_EDIT_INTERVAL = 1.0
+
 # Timezone setting (very important for event accuracy)
 TIME_ZONE = pytz.timezone('Asia/Jerusalem')
 
@@ -47,6 +132,19 @@ RETURN_END_TIME = "16:30:00"
 FRIDAY_RETURN_START_TIME = "11:30:00"
 FRIDAY_RETURN_END_TIME = "12:00:00"
 
+# How pickups are written to the calendar:
+# "single"    - one event per pickup every week (default)
+# "recurring" - one weekly series per pickup slot; each week only the changed days are patched
+# Switching back to "single" is safe: the first commit ends the series before its week, and
+# one-off events replace them from then on.
+PICKUP_MODE = os.getenv("PICKUP_MODE", "single")
+
+# What a commit does when some of its changes fail:
+# "best_effort" - keeps the changes that went through and reports the failed ones (default)
+# "atomic"      - retries the failed changes once, and if they still fail takes back the rest,
+#                 so the calendar is left exactly as it was (the commit job is then retried)
+COMMIT_MODE = os.getenv("COMMIT_MODE", "best_effort")
+
 # Kindergarten (Kimel)
 KINDERGARTEN_START_TIME = "09:00:00"
 KINDERGARTEN_END_TIME = "17:00:00"
@@ -66,11 +164,35 @@ KIMEL_INITIAL_COUNT = 9  # Initial counter value
 KIMEL_MAX_COUNT = 10  # Maximum count before reset
 KIMEL_RESET_COUNT = 1  # Value to reset to after reaching max
 
-# --- 5. LOGIC & UI CONSTANTS ---
+# Counter value at the first commit of each week, so re-committing a week keeps its numbering
+KIMEL_WEEK_START_KEY = "kimel_week_start"
+KIMEL_WEEKS_TO_REMEMBER = 8
+
+# The changes that undo a household's last commit (for /undo)
+LAST_COMMIT_KEY = "last_commit"
+
+# --- 5. PERSISTENCE ---
+# Conversation state and the Kimel counter survive restarts (SQLite, WAL mode)
+PERSISTENCE_FILE = "hilalon_bot.sqlite3"
+PERSISTENCE_UPDATE_INTERVAL = 5  # seconds between the application's persistence runs
+PERSISTENCE_COALESCE_DELAY = 1.0  # changes within this many seconds share one transaction
+
+# --- 6. LOGIC & UI CONSTANTS ---
 
 # Day names for display (indices 0-6)
 HEBREW_DAYS = ["ראשון", "שני", "שלישי", "רביעי", "חמישי", "שישי", "שבת"]
 
+# Cached day-selection keyboards (each step has at most 128 selection states per day)
+KEYBOARD_CACHE_SIZE = 1024
+
+# Run the whole planning wizard inside a single message that is edited in place
+# (one API call per step instead of two). Enable with SINGLE_MESSAGE_FLOW=1
+SINGLE_MESSAGE_FLOW = os.getenv("SINGLE_MESSAGE_FLOW", "0") == "1"
+
+# The first keyboard edit of a message goes out at once; further edits within this many
+# seconds of it are folded into one trailing edit
+EDIT_DEBOUNCE_DELAY = 0.4
+
 # Conversation states
 STATE_PICKUP, STATE_DATE_HILA, STATE_DATE_ALON, STATE_KIMEL, STATE_CONFIRM = range(5)
 
@@ -86,6 +208,8 @@ ACTION_DONE = "DONE"
 ACTION_NONE = "NONE"
 ACTION_CONFIRM = "CONFIRM"
 ACTION_CANCEL = "CANCEL"
+ACTION_BULK_COPY = "BULK_COPY"  # Same schedule for cfg.BULK_WEEKS weeks
+ACTION_BULK_ALTERNATE = "BULK_ALT"  # Alternating schedule for cfg.BULK_WEEKS weeks
 
 COLOR_ID = '10'
 
@@ -0,0 +1,93 @@
+import asyncio
+import bisect
+import logging
+from telegram.helpers import escape_markdown
+import config as cfg
+from event_plan import compile_week, week_context
+from calendar_mirror import calendar_mirror, sync_tenant_async, event_time
+from startup import calendar_loaded
+
+logger = logging.getLogger(__name__)
+
+# --- Conflicts with the existing calendar ---
+# Before the user confirms, the planned pickups and date nights are checked against what is
+# already on the household's calendar. The mirror (calendar_mirror.py) is first brought up to
+# date with one incremental sync - an event added a minute ago must be flagged too - and the
+# whole week is then read with one time-range query, the bot's own events excluded. Every
+# planned slot is looked up in an interval index built from the result, so the check costs
+# the same for any number of slots.
+
+
+class BusyIndex:
+    """
+    Busy intervals (start, end, title) sorted by start. overlapping() bisects to the intervals
+    that start before the query ends, and looks back no further than the longest interval,
+    so a lookup only touches intervals that can overlap.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.starts = [start for start, _end, _title in self.intervals]
+        self.longest = max((end - start for start, end, _title in self.intervals), default=0)
+
+    def overlapping(self, start, end):
+        lo = bisect.bisect_left(self.starts, start - self.longest)
+        hi = bisect.bisect_left(self.starts, end)
+        return [title for s, e, title in self.intervals[lo:hi] if e > start and s < end]
+
+
+def find_conflicts(specs, busy):
+    """[(spec, titles of the events it overlaps)] for the specs of cfg.CONFLICT_SLOTS that overlap `busy`."""
+    conflicts = []
+    for spec in specs:
+        if spec.slot not in cfg.CONFLICT_SLOTS:
+            continue
+        titles = busy.overlapping(spec.start.timestamp(), spec.end.timestamp())
+        if titles:
+            conflicts.append((spec, titles))
+    return conflicts
+
+
+async def week_conflicts(tenant, schedule, window_start):
+    """
+    The planned week's conflicts with the household's calendar.
+    Returns None if the calendar could not be checked (it is never worth delaying the summary).
+    """
+    if cfg.CALENDAR_BACKEND != "google":
+        return None
+    week = week_context(window_start)
+    if not calendar_loaded():
+        # The Google stack waits for the first confirmation (cfg.CALENDAR_WARMUP_DELAY < 0) -
+        # check against the mirror as of its last sync, if there is one
+        if calendar_mirror.synced_at(tenant.calendar_id) is None:
+            return None
+    else:
+        try:
+            # One syncToken call, bounded so a slow Google never holds up the summary
+            await asyncio.wait_for(sync_tenant_async(tenant), timeout=cfg.CONFLICT_CHECK_TIMEOUT)
+        except Exception as e:
+            if calendar_mirror.synced_at(tenant.calendar_id) is None:
+                logger.warning(f"Conflict check skipped ({tenant.tenant_id}): {e!r}")
+                return None
+            logger.warning(f"Conflict check uses the mirror as of its last sync ({tenant.tenant_id}): {e!r}")
+    try:
+        events = await asyncio.to_thread(calendar_mirror.events_between, tenant.calendar_id,
+                                         week.time_min, week.time_max, False)
+    except Exception as e:
+        logger.warning(f"Conflict check skipped ({tenant.tenant_id}): {e!r}")
+        return None
+
+    # Like freebusy: events marked "free" don't block, and neither do all-day events (birthdays, holidays)
+    busy = BusyIndex((event_time(ev['start']), event_time(ev['end']), ev.get('summary') or "(ללא כותרת)")
+                     for ev in events if ev.get('transparency') != 'transparent' and 'dateTime' in ev['start'])
+    specs, _counter = compile_week(schedule, window_start, tenant.profile.kimel_initial, tenant.profile)
+    return find_conflicts(specs, busy)
+
+
+def format_conflicts(conflicts):
+    """The conflicts section of the summary message ('' if there are none)."""
+    if not conflicts:
+        return ""
+    lines = [f"• {cfg.HEBREW_DAYS[spec.day_index]} {spec.start:%H:%M} {spec.summary} ↔ "
+             f"{escape_markdown(', '.join(titles))}" for spec, titles in conflicts]
+    return "\n\n⚠️ **התנגשויות ביומן:**\n" + "\n".join(lines)
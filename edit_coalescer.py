@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EditCoalescer:
+    """
+    Coalesces reply-markup edits per message.
+    The first toggle is edited right away. Toggles that arrive while that edit is in flight,
+    or within `delay` seconds after it, are folded into one trailing edit carrying the latest
+    keyboard - so a single tap costs no waiting and a burst costs two edits. The last markup
+    rendered on each message is remembered, so an edit that would not change anything is never sent.
+    """
+
+    def __init__(self, delay, max_tracked=1000):
+        self.delay = delay
+        self.max_tracked = max_tracked
+        self._latest = {}  # (chat_id, message_id) -> (message, markup) waiting to be sent
+        self._tasks = {}
+        self._rendered = OrderedDict()  # (chat_id, message_id) -> markup currently shown
+        self.requested = 0
+        self.sent = 0
+
+    @property
+    def saved(self):
+        """Edits requested but never sent (folded into another edit, or identical to what is shown)."""
+        return self.requested - self.sent - len(self._latest)
+
+    @staticmethod
+    def _key(message):
+        return message.chat_id, message.message_id
+
+    def remember(self, message, markup):
+        """Records the markup a message was sent with."""
+        key = self._key(message)
+        self._rendered[key] = markup
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_tracked:
+            self._rendered.popitem(last=False)
+
+    def request(self, message, markup):
+        """Asks for `message` to show `markup`; returns immediately."""
+        key = self._key(message)
+        self.requested += 1
+        self._latest[key] = (message, markup)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._flush(key))
+
+    def discard(self, message):
+        """Drops a pending edit - call before the message is replaced by a step transition."""
+        key = self._key(message)
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+        self._latest.pop(key, None)
+        self._rendered.pop(key, None)
+
+    async def _flush(self, key):
+        try:
+            while key in self._latest:
+                message, markup = self._latest.pop(key)
+                if self._rendered.get(key) == markup:
+                    continue
+
+                self.sent += 1
+                try:
+                    await message.edit_reply_markup(reply_markup=markup)
+                except Exception as e:
+                    logger.error(f"Keyboard edit failed: {e}")
+                else:
+                    self.remember(message, markup)
+                logger.debug(f"Keyboard edits: {self.requested} requested, {self.sent} sent, {self.saved} saved")
+                # Toggles arriving from now on are folded into one trailing edit
+                await asyncio.sleep(self.delay)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
@@ -0,0 +1,276 @@
+import datetime
+import functools
+import hashlib
+from dataclasses import dataclass, field, replace
+from typing import Dict, Mapping, Optional, Tuple
+import config as cfg
+
+# --- Pure event-plan compiler ---
+# Turns a WeeklySchedule into a list of immutable EventSpec objects.
+# No network and no Google imports here - the calendar layer only consumes the list.
+
+BOT_TAG = "hilalon"
+EVENT_DESCRIPTION = "Created by HilAlon Bot"
+
+PICKUP_DAYS = range(6)  # 0-5 (Sunday to Friday)
+FRIDAY = 5
+
+
+def _parse_time(hhmmss):
+    return datetime.time.fromisoformat(hhmmss)
+
+
+@dataclass(frozen=True)
+class SlotTemplate:
+    """
+    One kind of event: its times (parsed once), reminders and title.
+    day_times overrides the times for specific day indices (e.g. the short Friday).
+    days_before moves the event before its anchor day (babysitter reminders).
+    """
+    slot: str
+    start: datetime.time
+    end: datetime.time
+    title: str
+    reminders: Tuple[int, ...] = (30, 10)
+    day_times: Tuple[Tuple[int, datetime.time, datetime.time], ...] = ()
+    days_before: int = 0
+
+    def times_for(self, day_idx):
+        for override_day, start, end in self.day_times:
+            if override_day == day_idx:
+                return start, end
+        return self.start, self.end
+
+
+@dataclass(frozen=True)
+class EventSpec:
+    """
+    A single planned calendar event.
+    anchor_date is the day the event belongs to (for a reminder - the date night day).
+    default_summary is set for pickup slots only: the title the recurring series carries.
+    """
+    slot: str
+    day_index: int
+    anchor_date: datetime.date
+    start: datetime.datetime
+    end: datetime.datetime
+    summary: str
+    reminders: Tuple[int, ...] = (30, 10)
+    default_summary: Optional[str] = None
+    description: str = EVENT_DESCRIPTION
+    color_id: str = cfg.COLOR_ID
+
+    @property
+    def event_id(self):
+        return make_event_id(self.anchor_date, self.slot)
+
+
+# Slot templates built from the time constants in config.py.
+# Titles are filled in with the household's names (see HouseholdProfile).
+SLOT_TEMPLATES = {
+    "morning": SlotTemplate("morning", _parse_time(cfg.DRIVE_START_TIME), _parse_time(cfg.DRIVE_END_TIME),
+                            "🎒 {driver} על {children}"),
+    "return": SlotTemplate("return", _parse_time(cfg.RETURN_START_TIME), _parse_time(cfg.RETURN_END_TIME),
+                           "🏠 {driver} על {children}",
+                           day_times=((FRIDAY, _parse_time(cfg.FRIDAY_RETURN_START_TIME),
+                                       _parse_time(cfg.FRIDAY_RETURN_END_TIME)),)),
+    "date_hila": SlotTemplate("date_hila", _parse_time(cfg.DATENIGHT_START_TIME), _parse_time(cfg.DATENIGHT_END_TIME),
+                              "🍷 דייט {parent_a}", reminders=(60,)),
+    "date_alon": SlotTemplate("date_alon", _parse_time(cfg.DATENIGHT_START_TIME), _parse_time(cfg.DATENIGHT_END_TIME),
+                              "🍺 דייט {parent_b}", reminders=(60,)),
+    "sitter_hila": SlotTemplate("sitter_hila", _parse_time(cfg.BABYSITTER_REMINDER_START_TIME),
+                                _parse_time(cfg.BABYSITTER_REMINDER_END_TIME),
+                                "⏰ בייביסיטר: {parent_a} דואגת", reminders=(0,),
+                                days_before=cfg.BABYSITTER_REMINDER_DAYS_BEFORE),
+    "sitter_alon": SlotTemplate("sitter_alon", _parse_time(cfg.BABYSITTER_REMINDER_START_TIME),
+                                _parse_time(cfg.BABYSITTER_REMINDER_END_TIME),
+                                "⏰ בייביסיטר: {parent_b} דואג", reminders=(0,),
+                                days_before=cfg.BABYSITTER_REMINDER_DAYS_BEFORE),
+    "kimel": SlotTemplate("kimel", _parse_time(cfg.KINDERGARTEN_START_TIME), _parse_time(cfg.KINDERGARTEN_END_TIME),
+                          "🧸 {kindergarten_child} בגן מס' {number}"),
+}
+
+
+
+def make_slot_templates(times=None, titles=None):
+    """
+    SLOT_TEMPLATES with some slots changed.
+    times: {slot: ("HH:MM:SS", "HH:MM:SS")}, titles: {slot: title}.
+    A slot's day_times (the short Friday return) are kept unless its times are given.
+    """
+    templates = dict(SLOT_TEMPLATES)
+    for slot, (start, end) in (times or {}).items():
+        templates[slot] = replace(templates[slot], start=_parse_time(start), end=_parse_time(end), day_times=())
+    for slot, title in (titles or {}).items():
+        templates[slot] = replace(templates[slot], title=title)
+    return templates
+
+
+@dataclass(frozen=True)
+class HouseholdProfile:
+    """
+    The household a week is compiled for: the names that go into event titles,
+    its slot templates and its Kimel numbering.
+    parent_a is the parent the wizard asks about first (pickup days, first date night);
+    by default parent_b drives in the morning and parent_a picks up in the afternoon.
+    """
+    parent_a: str = "הילה"
+    parent_b: str = "אלון"
+    children: str = "אלה וקימל"
+    kindergarten_child: str = "קימל"
+    templates: Mapping[str, SlotTemplate] = field(default_factory=lambda: SLOT_TEMPLATES, compare=False, hash=False)
+    kimel_initial: int = cfg.KIMEL_INITIAL_COUNT
+    kimel_max: int = cfg.KIMEL_MAX_COUNT
+    kimel_reset: int = cfg.KIMEL_RESET_COUNT
+
+    def title(self, template, **values):
+        return template.title.format(parent_a=self.parent_a, parent_b=self.parent_b, children=self.children,
+                                     kindergarten_child=self.kindergarten_child, **values)
+
+
+DEFAULT_PROFILE = HouseholdProfile()
+
+
+def make_event_id(anchor_date, slot):
+    """
+    Deterministic event ID for a slot on a given day.
+    Calendar IDs must use base32hex characters (0-9, a-v) - a hex digest qualifies.
+    """
+    return hashlib.sha1(f"{BOT_TAG}:{anchor_date.isoformat()}:{slot}".encode()).hexdigest()
+
+
+def week_dates(window_start):
+    """
+    The 7 planned dates, indexed by our day index (0=Sunday ... 6=Saturday).
+    The window is the 7 days starting at window_start (normally tomorrow).
+    """
+    dates = [None] * 7
+    for offset in range(7):
+        day = window_start + datetime.timedelta(days=offset)
+        dates[(day.weekday() + 1) % 7] = day  # Python: 0=Monday -> ours: 1
+    return dates
+
+
+def _local(day, time_of_day):
+    """Wall-clock time on a day -> aware datetime in cfg.TIME_ZONE (the right offset on DST days)."""
+    return cfg.TIME_ZONE.localize(datetime.datetime.combine(day, time_of_day))
+
+
+@dataclass(frozen=True)
+class WeekContext:
+    """
+    Everything date-related about one planned week, computed once:
+    dates[i] / labels[i] for day index i (0=Sunday), the time range covering all of the
+    week's events (including babysitter reminders before the window), and the aware
+    start/end of each slot on each day (computed on first use, then cached with the week) -
+    so compiling a week does no date math.
+    """
+    window_start: datetime.date
+    dates: Tuple[datetime.date, ...]
+    labels: Tuple[str, ...]
+    time_min: datetime.datetime
+    time_max: datetime.datetime
+    slot_times: Dict[Tuple[SlotTemplate, int], Tuple[datetime.datetime, datetime.datetime]] = field(
+        default_factory=dict, compare=False, hash=False, repr=False)
+
+    def slot_times_for(self, template, day_idx):
+        key = (template, day_idx)
+        times = self.slot_times.get(key)
+        if times is None:
+            start, end = template.times_for(day_idx)
+            day = self.dates[day_idx] - datetime.timedelta(days=template.days_before)
+            times = self.slot_times[key] = (_local(day, start), _local(day, end))
+        return times
+
+
+@functools.lru_cache(maxsize=32)
+def week_context(window_start):
+    """The WeekContext of the 7 days starting at window_start (cached - a few weeks are ever in use)."""
+    dates = tuple(week_dates(window_start))
+    labels = tuple(f"{cfg.HEBREW_DAYS[i]} ({d.day}/{d.month})" for i, d in enumerate(dates))
+
+    longest_lead = max(t.days_before for t in SLOT_TEMPLATES.values())
+    return WeekContext(
+        window_start=window_start,
+        dates=dates,
+        labels=labels,
+        time_min=_local(window_start - datetime.timedelta(days=longest_lead), datetime.time.min),
+        time_max=_local(window_start + datetime.timedelta(days=7), datetime.time.min),
+    )
+
+
+def local_today():
+    """Today in cfg.TIME_ZONE - not the server's date, which differs around midnight."""
+    return datetime.datetime.now(cfg.TIME_ZONE).date()
+
+
+def current_week():
+    """The week being planned right now: the 7 days starting tomorrow (Israel time)."""
+    return week_context(local_today() + datetime.timedelta(days=1))
+
+
+def advance_kimel_counter(counter, steps, max_count=cfg.KIMEL_MAX_COUNT, reset_count=cfg.KIMEL_RESET_COUNT):
+    for _ in range(steps):
+        counter += 1
+        if counter > max_count:
+            counter = reset_count  # Reset to 1 after reaching max
+    return counter
+
+
+def _spec(week, template, day_idx, summary, default_summary=None):
+    start, end = week.slot_times_for(template, day_idx)
+    return EventSpec(
+        slot=template.slot,
+        day_index=day_idx,
+        anchor_date=week.dates[day_idx],
+        start=start,
+        end=end,
+        summary=summary,
+        reminders=template.reminders,
+        default_summary=default_summary,
+    )
+
+
+def compile_week(schedule, window_start, kimel_start, profile=DEFAULT_PROFILE):
+    """
+    Compiles one week for a household (HouseholdProfile).
+    Returns (specs, kimel_counter) - the counter value after this week's Kimel days.
+    """
+    week = week_context(window_start)
+    templates = profile.templates
+    specs = []
+    morning, ret = templates["morning"], templates["return"]
+
+    # The recurring pickup series carry the default drivers
+    default_morning = profile.title(morning, driver=profile.parent_b)
+    default_return = profile.title(ret, driver=profile.parent_a)
+
+    # --- 1. Pickups (Sunday to Friday) ---
+    for day_idx in PICKUP_DAYS:
+        if schedule.pickup_mask >> day_idx & 1:
+            morning_driver, return_driver = profile.parent_a, profile.parent_b
+        else:
+            morning_driver, return_driver = profile.parent_b, profile.parent_a
+
+        specs.append(_spec(week, morning, day_idx,
+                           profile.title(morning, driver=morning_driver), default_morning))
+        specs.append(_spec(week, ret, day_idx,
+                           profile.title(ret, driver=return_driver), default_return))
+
+    # --- 2. Date nights + babysitter reminders ---
+    for date_idx, date_slot, sitter_slot in ((schedule.hila_date_index, "date_hila", "sitter_hila"),
+                                             (schedule.alon_date_index, "date_alon", "sitter_alon")):
+        if date_idx is None:
+            continue
+        for slot in (date_slot, sitter_slot):
+            template = templates[slot]
+            specs.append(_spec(week, template, date_idx, profile.title(template)))
+
+    # --- 3. Kimel to kindergarten ---
+    kimel = templates["kimel"]
+    counter = kimel_start
+    for day_idx in schedule.kimel_indices:
+        specs.append(_spec(week, kimel, day_idx, profile.title(kimel, number=counter)))
+        counter = advance_kimel_counter(counter, 1, profile.kimel_max, profile.kimel_reset)
+
+    return specs, counter
@@ -0,0 +1,78 @@
+"""
+Fake Telegram sender for the webhook mode: posts synthetic updates to the local webhook
+server the way Telegram does, then prints the server's latency numbers from the health
+endpoint.
+
+    BOT_MODE=webhook python telegram_bot.py
+    python fake_telegram_sender.py --count 500
+
+By default the updates are plain text messages no handler answers, so no request reaches
+the real Telegram API and only the update-to-handler path is measured. Sending "/start"
+from an authorized user ID exercises the real conversation (and does call Telegram).
+"""
+import argparse
+import http.client
+import json
+import time
+import config as cfg
+from latency_stats import percentile
+
+
+def make_update(update_id, user_id, text):
+    now = int(time.time())
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': now,
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Fake'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Fake'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else [],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=cfg.WEBHOOK_LISTEN)
+    parser.add_argument('--port', type=int, default=cfg.WEBHOOK_PORT)
+    parser.add_argument('--secret', default=cfg.WEBHOOK_SECRET)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.0, help="seconds between updates")
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--text', default="ping")
+    parser.add_argument('--first-update-id', type=int, default=int(time.time()))
+    args = parser.parse_args()
+
+    headers = {'Content-Type': 'application/json'}
+    if args.secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = args.secret
+
+    conn = http.client.HTTPConnection(args.host, args.port, timeout=10)
+    round_trips = []
+    failed = 0
+    for i in range(args.count):
+        body = json.dumps(make_update(args.first_update_id + i, args.user_id, args.text))
+        started = time.perf_counter()
+        conn.request('POST', cfg.WEBHOOK_PATH, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        round_trips.append((time.perf_counter() - started) * 1000)
+        if response.status != 200:
+            failed += 1
+        if args.interval:
+            time.sleep(args.interval)
+
+    time.sleep(0.5)  # let the application process the tail of the queue
+    conn.request('GET', cfg.HEALTH_PATH)
+    health = json.loads(conn.getresponse().read())
+    conn.close()
+
+    print(f"Sent {args.count} updates ({failed} rejected)")
+    print(f"HTTP round trip: p50 {percentile(round_trips, 0.5):.2f} ms, p99 {percentile(round_trips, 0.99):.2f} ms")
+    print("Server:", json.dumps(health, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# --- Latency percentiles ---
+# One nearest-rank percentile for every latency report: the health endpoint, the update
+# processor's lock waits, the commit queue and the benchmarks.
+
+
+def percentile(values, q, default=None):
+    """The q-quantile (0..1) of values by nearest rank, or `default` when there are none."""
+    if not values:
+        return default
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
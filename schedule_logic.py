@@ -1,27 +1,62 @@
-from config import HEBREW_DAYS, KINDERGARTEN_START_TIME, KINDERGARTEN_END_TIME
+from config import HEBREW_DAYS
+from event_plan import DEFAULT_PROFILE
+
+
+NO_DAY = 0xFF  # Serialized value of "no date night chosen"
+
+
+def _mask_of(indices):
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+def _indices_of(mask):
+    return [i for i in range(7) if mask >> i & 1]
 
 
 class WeeklySchedule:
     """
     Class that manages the state of the weekly schedule.
     Each user will receive their own instance of this class.
+
+    Pickup and Kimel days are stored as 7-bit masks (bit i = day i), so toggles are O(1)
+    and the whole schedule serializes to 4 bytes (see to_bytes). hila_pickup_indices and
+    kimel_indices are still available as sorted lists for existing callers.
     """
 
+    __slots__ = ('pickup_mask', 'kimel_mask', 'hila_date_index', 'alon_date_index')
+
     def __init__(self):
-        # Lists of numbers (0-6 representing days of the week)
-        self.hila_pickup_indices = []
+        # Bit masks over days 0-6 (0=Sunday)
+        self.pickup_mask = 0
+        self.kimel_mask = 0
         self.hila_date_index = None
         self.alon_date_index = None
-        self.kimel_indices = []
+
+    # --- List views (sorted day indices) ---
+
+    @property
+    def hila_pickup_indices(self):
+        return _indices_of(self.pickup_mask)
+
+    @hila_pickup_indices.setter
+    def hila_pickup_indices(self, indices):
+        self.pickup_mask = _mask_of(indices)
+
+    @property
+    def kimel_indices(self):
+        return _indices_of(self.kimel_mask)
+
+    @kimel_indices.setter
+    def kimel_indices(self, indices):
+        self.kimel_mask = _mask_of(indices)
 
         # --- Functions for managing selections (Logic) ---
 
     def toggle_pickup(self, day_index):
-        if day_index in self.hila_pickup_indices:
-            self.hila_pickup_indices.remove(day_index)
-        else:
-            self.hila_pickup_indices.append(day_index)
-            self.hila_pickup_indices.sort()
+        self.pickup_mask ^= 1 << day_index
 
     def set_date_hila(self, day_index):
         self.hila_date_index = day_index
@@ -30,17 +65,88 @@ class WeeklySchedule:
         self.alon_date_index = day_index
 
     def toggle_kimel(self, day_index):
-        if day_index in self.kimel_indices:
-            self.kimel_indices.remove(day_index)
-        else:
-            self.kimel_indices.append(day_index)
-            self.kimel_indices.sort()
+        self.kimel_mask ^= 1 << day_index
 
     def clear_kimel(self):
-        self.kimel_indices = []
+        self.kimel_mask = 0
+
+    # --- Serialization ---
+
+    def to_bytes(self):
+        """4 bytes: pickup mask, Kimel mask, Hila's date, Alon's date (0xFF = none)."""
+        return bytes((
+            self.pickup_mask,
+            self.kimel_mask,
+            NO_DAY if self.hila_date_index is None else self.hila_date_index,
+            NO_DAY if self.alon_date_index is None else self.alon_date_index,
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        schedule = cls()
+        schedule.pickup_mask, schedule.kimel_mask, hila_date, alon_date = data
+        schedule.hila_date_index = None if hila_date == NO_DAY else hila_date
+        schedule.alon_date_index = None if alon_date == NO_DAY else alon_date
+        return schedule
+
+    def __getstate__(self):
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled by the older list-based version of this class
+            state = WeeklySchedule.from_dict(state).to_bytes()
+        other = WeeklySchedule.from_bytes(state)
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+    def __eq__(self, other):
+        if not isinstance(other, WeeklySchedule):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def __repr__(self):
+        return f"WeeklySchedule({self.to_bytes().hex()})"
+
+    # --- Functions for multi-week planning ---
+
+    def copy(self):
+        return WeeklySchedule.from_bytes(self.to_bytes())
+
+    def alternated(self):
+        """
+        The "other" week of an alternating pattern:
+        pickup days flip between Hila and Alon (Sunday-Friday) and the date nights swap.
+        Kimel days stay the same.
+        """
+        other = self.copy()
+        other.pickup_mask = ~self.pickup_mask & 0b111111
+        other.hila_date_index = self.alon_date_index
+        other.alon_date_index = self.hila_date_index
+        return other
+
+    def to_dict(self):
+        return {
+            'hila_pickup_indices': self.hila_pickup_indices,
+            'hila_date_index': self.hila_date_index,
+            'alon_date_index': self.alon_date_index,
+            'kimel_indices': self.kimel_indices,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        schedule = cls()
+        schedule.hila_pickup_indices = data.get('hila_pickup_indices', [])
+        schedule.hila_date_index = data.get('hila_date_index')
+        schedule.alon_date_index = data.get('alon_date_index')
+        schedule.kimel_indices = data.get('kimel_indices', [])
+        return schedule
 
     # --- Function that generates summary text ---
-    def get_summary_text(self):
+    def get_summary_text(self, profile=DEFAULT_PROFILE):
         # Convert from numbers (0,1) to day names
         hila_pu_names = [HEBREW_DAYS[i] for i in self.hila_pickup_indices]
         kimel_names = [HEBREW_DAYS[i] for i in self.kimel_indices]
@@ -48,12 +154,14 @@ class WeeklySchedule:
         hila_date = HEBREW_DAYS[self.hila_date_index] if self.hila_date_index is not None else "לא נבחר"
         alon_date = HEBREW_DAYS[self.alon_date_index] if self.alon_date_index is not None else "לא נבחר"
 
+        kimel = profile.templates["kimel"]
+
         return (
             "📋 **סיכום לו\"ז שבועי:**\n\n"
-            f"🎒 **איסוף הילה:** {', '.join(hila_pu_names) if hila_pu_names else 'ללא'}\n"
-            f"🍷 **דייט הילה:** {hila_date}\n"
-            f"🍺 **דייט אלון:** {alon_date}\n"
-            f"🧸 **קימל בגן ({KINDERGARTEN_START_TIME}-{KINDERGARTEN_END_TIME}):**\n"
+            f"🎒 **איסוף {profile.parent_a}:** {', '.join(hila_pu_names) if hila_pu_names else 'ללא'}\n"
+            f"🍷 **דייט {profile.parent_a}:** {hila_date}\n"
+            f"🍺 **דייט {profile.parent_b}:** {alon_date}\n"
+            f"🧸 **{profile.kindergarten_child} בגן ({kimel.start.isoformat()}-{kimel.end.isoformat()}):**\n"
             f"   {', '.join(kimel_names) if kimel_names else 'ללא'}"
         )
 
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+from telegram.ext import BasePersistence, PersistenceInput
+import config as cfg
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Application persistence stored in a single SQLite file (WAL mode).
+    Keeps user_data (the WeeklySchedule of a conversation in progress), bot_data
+    (the Kimel counter) and the conversation states across restarts.
+
+    Writes are coalesced: every update_* call only snapshots the data, and all changes
+    collected during cfg.PERSISTENCE_COALESCE_DELAY seconds are written in one transaction,
+    so a burst of button presses costs one commit. The database is opened and read
+    lazily, on the first get_* call of Application.initialize().
+    """
+
+    def __init__(self, filepath, update_interval=cfg.PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(user_data=True, chat_data=True, bot_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.filepath = filepath
+        self._conn = None
+        self._lock = threading.Lock()  # the connection is used from worker threads
+        self._pending = {}  # (table, key) -> bytes / str, or None to delete
+        self._write_task = None
+        self.writes = 0  # transactions committed
+        self.coalesced = 0  # updates that were folded into another update's transaction
+
+    # --- Connection ---
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    # --- Coalesced writes ---
+
+    def _queue(self, table, key, value):
+        if (table, key) in self._pending:
+            self.coalesced += 1
+        self._pending[(table, key)] = value
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_later())
+
+    async def _write_later(self):
+        await asyncio.sleep(cfg.PERSISTENCE_COALESCE_DELAY)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.to_thread(self._write, pending)
+
+    def _write(self, pending):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (table, key), value in pending.items():
+                    if table == 'conversations':
+                        name, conv_key = key
+                        if value is None:
+                            conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, conv_key))
+                        else:
+                            conn.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                         (name, conv_key, value))
+                    elif value is None:
+                        conn.execute(f"DELETE FROM {table} WHERE id = ?", (key,))
+                    else:
+                        conn.execute(f"INSERT OR REPLACE INTO {table} (id, value) VALUES (?, ?)", (key, value))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self.writes += 1
+
+    # --- Reads (called once by Application.initialize) ---
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(self._read, "SELECT id, value FROM user_data")
+        return {user_id: pickle.loads(value) for user_id, value in rows}
+
+    async def get_chat_data(self):
+        rows = await asyncio.to_thread(self._read, "SELECT id, value FROM chat_data")
+        return {chat_id: pickle.loads(value) for chat_id, value in rows}
+
+    async def get_bot_data(self):
+        rows = await asyncio.to_thread(self._read, "SELECT value FROM bot_data WHERE id = 0")
+        return pickle.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(self._read, "SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    # --- Updates ---
+
+    async def update_user_data(self, user_id, data):
+        self._queue('user_data', user_id, pickle.dumps(data))
+
+    async def update_chat_data(self, chat_id, data):
+        self._queue('chat_data', chat_id, pickle.dumps(data))
+
+    async def update_bot_data(self, data):
+        self._queue('bot_data', 0, pickle.dumps(data))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else json.dumps(new_state)
+        self._queue('conversations', (name, json.dumps(list(key))), state)
+
+    async def drop_user_data(self, user_id):
+        self._queue('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._queue('chat_data', chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Called on shutdown: writes whatever is still pending and closes the database."""
+        if self._write_task and not self._write_task.done():
+            self._write_task.cancel()
+        await self._write_pending()
+        logger.info(f"Persistence: {self.writes} transactions, {self.coalesced} updates coalesced")
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
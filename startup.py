@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+import time
+import config as cfg
+
+logger = logging.getLogger(__name__)
+
+# --- Cold start ---
+# The Google client stack (googleapiclient, google-auth, oauthlib, httplib2) is the slowest
+# part of importing the bot, so calendar_utils is not imported at startup: it is loaded in
+# the background shortly after the bot starts, or by the first confirmation, whichever
+# comes first. StartupTimer records how long each startup phase took.
+
+
+class StartupTimer:
+    """Durations of consecutive startup phases, measured from this module's import."""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._last = self._started
+        self.phases = []  # (name, ms)
+        self.background = {}  # name -> ms, for work done off the startup path
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, round((now - self._last) * 1000, 1)))
+        self._last = now
+
+    @property
+    def total_ms(self):
+        return round(sum(ms for _, ms in self.phases), 1)
+
+    def report(self):
+        parts = [f"{name} {ms:.0f} ms" for name, ms in self.phases]
+        return f"Startup: {' | '.join(parts)} | total {self.total_ms:.0f} ms"
+
+    def as_dict(self):
+        return {'phases_ms': dict(self.phases), 'total_ms': self.total_ms, 'background_ms': dict(self.background)}
+
+
+startup_timer = StartupTimer()
+
+_import_lock = threading.Lock()
+_calendar = None  # calendar_utils, once fully imported
+
+
+def calendar_module():
+    """
+    Imports calendar_utils (blocking) and returns it. Only the first call pays for the import.
+    A plain import statement, so PyInstaller's analysis still bundles the Google stack.
+    """
+    global _calendar
+    if _calendar is None:
+        with _import_lock:
+            if _calendar is None:
+                started = time.perf_counter()
+                import calendar_utils
+                elapsed = round((time.perf_counter() - started) * 1000, 1)
+                startup_timer.background['google stack'] = elapsed
+                logger.info(f"Google stack loaded in {elapsed:.0f} ms")
+                _calendar = calendar_utils
+    return _calendar
+
+
+def calendar_loaded():
+    """Whether the Google stack is loaded - background work that needs it waits until then."""
+    return _calendar is not None
+
+
+async def load_calendar():
+    """calendar_module() without blocking the event loop (the import runs in a thread)."""
+    if _calendar is not None:
+        return _calendar
+    return await asyncio.to_thread(calendar_module)
+
+
+async def warm_up_calendar(context):
+    """Job callback: loads the Google stack in the background once the bot is running."""
+    await load_calendar()
+
+
+async def report_startup(context):
+    """Job callback run as soon as the application has started: logs the startup report."""
+    startup_timer.mark("start application")
+    logger.info(startup_timer.report())
+    if cfg.CALENDAR_WARMUP_DELAY >= 0 and cfg.CALENDAR_BACKEND == "google":
+        context.job_queue.run_once(warm_up_calendar, when=cfg.CALENDAR_WARMUP_DELAY)
+
+
+async def refresh_calendar_token(context):
+    """Job callback: keeps the OAuth token fresh - once the Google stack is loaded."""
+    if _calendar is not None:
+        await _calendar.refresh_calendar_token(context)
@@ -1,16 +1,37 @@
 import os
+import asyncio
+import functools
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Imported first, so the startup report covers every import below
+from startup import startup_timer, report_startup, refresh_calendar_token
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes
+from telegram.error import TelegramError
+from telegram.ext import (Application, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes,
+                          TypeHandler)
+
+startup_timer.mark("telegram imports")
+
 import config as cfg
 import datetime
 from schedule_logic import get_schedule, WeeklySchedule
-from calendar_utils import create_weekly_events_in_calendar
+from event_plan import current_week, week_context
+from tenants import tenants
+from throttling import TelegramRateLimiter
+from edit_coalescer import EditCoalescer
+from sqlite_persistence import SQLitePersistence
+from commit_scheduler import plan_weeks, bulk_window_starts
+from commit_queue import close_stores, commit_jobs, notify_workers, start_commit_workers
+from calendar_mirror import sync_calendar_mirrors
+from conflicts import week_conflicts, format_conflicts
+from webhook_server import UpdateLatency, StampedQueue, run_webhook
+from update_processor import PerChatUpdateProcessor
+
+startup_timer.mark("bot modules")
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,32 +42,28 @@ def get_date_str(day_index):
     Receives a day index (0-6) and returns a string with the upcoming date.
     For example: 'Sunday (17/12)'
     """
-    today = datetime.date.today()
-    # Calculate the date (same logic as in calendar_utils)
-    current_weekday = (today.weekday() + 1) % 7  # Adjust to our indices (0=Sunday)
-    days_ahead = day_index - current_weekday
-    if days_ahead <= 0:
-        days_ahead += 7
+    return current_week().labels[day_index]
 
-    target_date = today + datetime.timedelta(days=days_ahead)
-    return f"{cfg.HEBREW_DAYS[day_index]} ({target_date.day}/{target_date.month})"
 
 # --- Helper function for keyboard ---
-def build_days_keyboard(prefix, selected_indices=None, exclude_indices=None, include_done=True, include_none=False):
-    if selected_indices is None: selected_indices = []
-    if exclude_indices is None: exclude_indices = []
 
-    buttons = []
-    is_date_step = "DATE" in prefix or "DH_" in prefix or "DA_" in prefix
-    limit = 7 if is_date_step else 6
+# How many day buttons each step shows (the date steps include Saturday)
+DAY_BUTTONS = {
+    cfg.PREFIX_PICKUP: 6,
+    cfg.PREFIX_DATE_HILA: 7,
+    cfg.PREFIX_DATE_ALON: 7,
+    cfg.PREFIX_KIMEL: 6,
+}
+
 
-    for i in range(limit):
-        if i in exclude_indices: continue
-        day_name = cfg.HEBREW_DAYS[i]
-        is_selected = i in selected_indices
-        text = f"✅ {day_name}" if is_selected else day_name
-        callback_data = f"{prefix}{i}"
-        buttons.append(InlineKeyboardButton(text, callback_data=callback_data))
+@functools.lru_cache(maxsize=cfg.KEYBOARD_CACHE_SIZE)
+def _days_keyboard(prefix, selected_mask, exclude_mask, include_done, include_none, window_start):
+    labels = week_context(window_start).labels
+    buttons = []
+    for i in range(DAY_BUTTONS[prefix]):
+        if exclude_mask >> i & 1: continue
+        text = f"✅ {labels[i]}" if selected_mask >> i & 1 else labels[i]
+        buttons.append(InlineKeyboardButton(text, callback_data=f"{prefix}{i}"))
 
     rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
     controls = []
@@ -60,31 +77,71 @@ def build_days_keyboard(prefix, selected_indices=None, exclude_indices=None, inc
     return InlineKeyboardMarkup(rows)
 
 
-def is_authorized(update: Update):
-    """Check if the user is in the authorized users list."""
-    # If the list is empty, don't authorize anyone
-    if not cfg.AUTHORIZED_USER_IDS:
-        return False
+def build_days_keyboard(prefix, selected_mask=0, exclude_mask=0, include_done=True, include_none=False):
+    """
+    Day-selection keyboard. Selections and exclusions are day bit masks (bit i = day i,
+    as in WeeklySchedule). Keyboards are immutable, so every (prefix, masks, flags) state
+    is built once per day and then served from the cache - a toggle is a dictionary lookup.
+    """
+    return _days_keyboard(prefix, selected_mask, exclude_mask, include_done, include_none,
+                          current_week().window_start)
 
-    # Check if the current user's ID is in the list
-    if update.effective_user.id not in cfg.AUTHORIZED_USER_IDS:
-        return False
 
-    return True
+# Folds bursts of toggles on the same message into one keyboard edit
+markup_edits = EditCoalescer(cfg.EDIT_DEBOUNCE_DELAY)
+
+
+def get_tenant(update: Update):
+    """The household of the user who sent the update (None if they are not a member of any)."""
+    user = update.effective_user
+    return tenants.for_user(user.id) if user else None
+
+
+def is_authorized(update: Update):
+    """Check if the user is a member of one of the households."""
+    return get_tenant(update) is not None
 
 
 async def thursday_push(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = cfg.ADMIN_CHAT_ID
-    if not chat_id:
+    for tenant in tenants:
+        for chat_id in tenant.reminder_chats:
+            try:
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text="חמישי הגיע 🙂 אם תרצי לסדר לו״ז מחדש כתבי /start"
+                )
+            except TelegramError as e:
+                logger.error(f"Weekly reminder to {chat_id} ({tenant.tenant_id}) failed: {e}")
+
+
+# --- HANDLERS with state memory ---
+
+async def advance_step(query, context, done_text, next_text, reply_markup):
+    """
+    Moves the conversation to its next step.
+    Default: freeze the current message with done_text and send a new message for the
+    next step (2 API calls). With cfg.SINGLE_MESSAGE_FLOW the whole wizard lives in one
+    message: the completed steps grow as a header above the current step, and each
+    transition is a single edit.
+    """
+    markup_edits.discard(query.message)
+
+    if cfg.SINGLE_MESSAGE_FLOW:
+        header = context.user_data.setdefault('flow_header', [])
+        header.append(done_text)
+        text = "\n".join(header) + "\n\n" + next_text
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        markup_edits.remember(query.message, reply_markup)
         return
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="חמישי הגיע 🙂 אם תרצי לסדר לו״ז מחדש כתבי /start"
-    )
+    # Freeze old message
+    await query.edit_message_text(done_text, parse_mode=ParseMode.MARKDOWN)
 
+    # New message for the next step
+    msg = await context.bot.send_message(chat_id=query.message.chat_id, text=next_text,
+                                         reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    markup_edits.remember(msg, reply_markup)
 
-# --- HANDLERS with state memory ---
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_authorized(update):
@@ -92,13 +149,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     context.user_data['schedule_obj'] = WeeklySchedule()
+    context.user_data['flow_header'] = []
 
-    if cfg.KIMEL_COUNTER_KEY not in context.application.bot_data:
-        context.application.bot_data[cfg.KIMEL_COUNTER_KEY] = cfg.KIMEL_INITIAL_COUNT
-
-    text = "היי! בואו נסדר את הלו\"ז.\n🗓 **שלב 1: ימי איסוף של הילה (בבוקר)**"
-    kb = build_days_keyboard(cfg.PREFIX_PICKUP, [], include_done=True)
-    await update.message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+    profile = get_tenant(update).profile
+    text = f"היי! בואו נסדר את הלו\"ז.\n🗓 **שלב 1: ימי איסוף של {profile.parent_a} (בבוקר)**"
+    kb = build_days_keyboard(cfg.PREFIX_PICKUP, include_done=True)
+    msg = await update.message.reply_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN)
+    markup_edits.remember(msg, kb)
     return cfg.STATE_PICKUP
 
 
@@ -116,6 +173,7 @@ async def handle_pickup_step(update: Update, context: ContextTypes.DEFAULT_TYPE)
     schedule = get_schedule(context)
 
     if action == cfg.ACTION_DONE:
+        profile = get_tenant(update).profile
         # Calculate remaining days for Alon
         all_days = set(range(6))
         hila_days = set(schedule.hila_pickup_indices)
@@ -126,27 +184,20 @@ async def handle_pickup_step(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         final_text = (
             f"✅ **סיכום איסוף בוקר (עם תאריכים):**\n"
-            f"👩 הילה: {hila_txt}\n"
-            f"👨 אלון: {alon_txt}"
+            f"👩 {profile.parent_a}: {hila_txt}\n"
+            f"👨 {profile.parent_b}: {alon_txt}"
         )
 
-        await query.edit_message_text(text=final_text, parse_mode=ParseMode.MARKDOWN)
-
-        # Send new message for next step
-        next_text = "**שלב 2: דייט שבועי - הילה 🍷**\nבחר את היום הרצוי:"
+        next_text = f"**שלב 2: דייט שבועי - {profile.parent_a} 🍷**\nבחר את היום הרצוי:"
         kb = build_days_keyboard(cfg.PREFIX_DATE_HILA, include_done=False)
-        await context.bot.send_message(chat_id=query.message.chat_id, text=next_text, reply_markup=kb,
-                                       parse_mode=ParseMode.MARKDOWN)
+        await advance_step(query, context, final_text, next_text, kb)
 
         return cfg.STATE_DATE_HILA
 
     # Regular toggle logic
     schedule.toggle_pickup(int(action))
-    new_kb = build_days_keyboard(cfg.PREFIX_PICKUP, selected_indices=schedule.hila_pickup_indices)
-    try:
-        await query.edit_message_reply_markup(new_kb)
-    except:
-        pass
+    new_kb = build_days_keyboard(cfg.PREFIX_PICKUP, selected_mask=schedule.pickup_mask)
+    markup_edits.request(query.message, new_kb)
     return cfg.STATE_PICKUP
 
 
@@ -162,16 +213,14 @@ async def handle_date_hila_step(update: Update, context: ContextTypes.DEFAULT_TY
     day_index = int(query.data.replace(cfg.PREFIX_DATE_HILA, ""))
     schedule = get_schedule(context)
     schedule.set_date_hila(day_index)
-
-    # Freeze old message
-    await query.edit_message_text(f"✅ נבחר דייט להילה: **{cfg.HEBREW_DAYS[day_index]}**", parse_mode=ParseMode.MARKDOWN)
-
-    # New message
-    kb = build_days_keyboard(cfg.PREFIX_DATE_ALON, exclude_indices=[day_index], include_done=False)
-    await context.bot.send_message(
-        chat_id=query.message.chat_id,
-        text="**שלב 3: דייט שבועי - אלון 🍺**\nבחר את היום הרצוי:",
-        reply_markup=kb, parse_mode=ParseMode.MARKDOWN
+    profile = get_tenant(update).profile
+
+    kb = build_days_keyboard(cfg.PREFIX_DATE_ALON, exclude_mask=1 << day_index, include_done=False)
+    await advance_step(
+        query, context,
+        f"✅ נבחר דייט ל{profile.parent_a}: **{cfg.HEBREW_DAYS[day_index]}**",
+        f"**שלב 3: דייט שבועי - {profile.parent_b} 🍺**\nבחר את היום הרצוי:",
+        kb
     )
     return cfg.STATE_DATE_ALON
 
@@ -188,16 +237,14 @@ async def handle_date_alon_step(update: Update, context: ContextTypes.DEFAULT_TY
     day_index = int(query.data.replace(cfg.PREFIX_DATE_ALON, ""))
     schedule = get_schedule(context)
     schedule.set_date_alon(day_index)
-
-    # Freeze message
-    await query.edit_message_text(f"✅ נבחר דייט לאלון: **{cfg.HEBREW_DAYS[day_index]}**", parse_mode=ParseMode.MARKDOWN)
-
-    # New message
-    kb = build_days_keyboard(cfg.PREFIX_KIMEL, [], include_done=True, include_none=True)
-    await context.bot.send_message(
-        chat_id=query.message.chat_id,
-        text="**שלב 4: קימל בגן 🧸**\nסמן את הימים:",
-        reply_markup=kb, parse_mode=ParseMode.MARKDOWN
+    profile = get_tenant(update).profile
+
+    kb = build_days_keyboard(cfg.PREFIX_KIMEL, include_done=True, include_none=True)
+    await advance_step(
+        query, context,
+        f"✅ נבחר דייט ל{profile.parent_b}: **{cfg.HEBREW_DAYS[day_index]}**",
+        f"**שלב 4: {profile.kindergarten_child} בגן 🧸**\nסמן את הימים:",
+        kb
     )
     return cfg.STATE_KIMEL
 
@@ -218,33 +265,28 @@ async def handle_kimel_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == cfg.ACTION_DONE or action == cfg.ACTION_NONE:
         if action == cfg.ACTION_NONE: schedule.clear_kimel()
 
-        # Freeze current Kimel message
         kimel_txt = ', '.join([cfg.HEBREW_DAYS[i] for i in schedule.kimel_indices]) or "ללא"
-        await query.edit_message_text(f"✅ נבחרו ימי קימל: {kimel_txt}", parse_mode=ParseMode.MARKDOWN)
 
-        # New message for final summary
-        summary = schedule.get_summary_text()
+        # Final summary, with the planned slots that clash with events already on the calendar
+        tenant = get_tenant(update)
+        summary = schedule.get_summary_text(tenant.profile)
+        summary += format_conflicts(await week_conflicts(tenant, schedule, current_week().window_start))
         buttons = [
             [InlineKeyboardButton("🚀 אשר וצור אירועים", callback_data=cfg.ACTION_CONFIRM)],
+            [InlineKeyboardButton(f"📆 אותו לו\"ז ל-{cfg.BULK_WEEKS} שבועות", callback_data=cfg.ACTION_BULK_COPY)],
+            [InlineKeyboardButton(f"🔀 לסירוגין ל-{cfg.BULK_WEEKS} שבועות", callback_data=cfg.ACTION_BULK_ALTERNATE)],
             [InlineKeyboardButton("❌ בטל הכל", callback_data=cfg.ACTION_CANCEL)]
         ]
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=summary,
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode=ParseMode.MARKDOWN
-        )
+        await advance_step(query, context, f"✅ נבחרו ימי קימל: {kimel_txt}", summary,
+                           InlineKeyboardMarkup(buttons))
         return cfg.STATE_CONFIRM
 
     # Toggle days
     day_index = int(action)
     schedule.toggle_kimel(day_index)
-    new_kb = build_days_keyboard(cfg.PREFIX_KIMEL, selected_indices=schedule.kimel_indices, include_done=True,
+    new_kb = build_days_keyboard(cfg.PREFIX_KIMEL, selected_mask=schedule.kimel_mask, include_done=True,
                                  include_none=True)
-    try:
-        await query.edit_message_reply_markup(new_kb)
-    except:
-        pass
+    markup_edits.request(query.message, new_kb)
     return cfg.STATE_KIMEL
 
 
@@ -257,34 +299,73 @@ async def handle_final_confirmation(update: Update, context: ContextTypes.DEFAUL
         return ConversationHandler.END
 
     await query.answer()
-
-    if query.data == cfg.ACTION_CONFIRM:
-        await query.edit_message_text("🚀 יוצר אירועים ביומן... אנא המתן.", parse_mode=ParseMode.MARKDOWN)
+    tenant = get_tenant(update)
+
+    if query.data in (cfg.ACTION_CONFIRM, cfg.ACTION_BULK_COPY, cfg.ACTION_BULK_ALTERNATE):
+        if query.data == cfg.ACTION_CONFIRM:
+            schedules = [get_schedule(context)]
+            window_starts = [current_week().window_start]
+            ack_text = "📥 התקבל! האירועים ייווצרו ביומן בעוד רגע."
+        else:
+            schedules = plan_weeks(get_schedule(context), cfg.BULK_WEEKS,
+                                   alternate=query.data == cfg.ACTION_BULK_ALTERNATE)
+            window_starts = bulk_window_starts(cfg.BULK_WEEKS)
+            ack_text = f"📥 התקבל! האירועים ל-{cfg.BULK_WEEKS} שבועות ייווצרו ביומן בעוד רגע."
 
         # --- Here's where the magic happens ---
-        schedule = get_schedule(context)
-        try:
-            results_text = create_weekly_events_in_calendar(
-                schedule, context.application.bot_data
-            )
-            await context.bot.send_message(chat_id=query.message.chat_id, text=results_text)
-        except Exception as e:
-            logger.error(f"Calendar Error: {e}")
-            await context.bot.send_message(chat_id=query.message.chat_id, text=f"❌ שגיאה ביצירת אירועים: {e}")
-
+        # The commit is stored as a durable job and acknowledged right away; a commit worker
+        # writes the events and sends the result as a follow-up message
+        status_msg = await query.edit_message_text(ack_text)
+        await asyncio.to_thread(commit_jobs.enqueue, tenant.tenant_id, query.message.chat_id, schedules,
+                                window_starts, status_msg.message_id)
+        notify_workers()
         return ConversationHandler.END
     else:
         await query.edit_message_text("בוטל. ניתן להתחיל מחדש עם /start")
         return ConversationHandler.END
 
 
-# --- 3. MAIN APP SETUP ---
-def main():
-    if not cfg.TELEGRAM_BOT_TOKEN:
-        print("Error: Token is missing!")
+async def undo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/undo - takes back the household's last calendar commit (as a commit job)."""
+    tenant = get_tenant(update)
+    if tenant is None:
+        await update.message.reply_text("⛔️ אין לך הרשאה להשתמש בבוט זה. הבוט משרת משתמשים מורשים בלבד.")
         return
 
-    app = Application.builder().token(cfg.TELEGRAM_BOT_TOKEN).build()
+    status_msg = await update.message.reply_text("📥 התקבל! הפעולה האחרונה תבוטל בעוד רגע.")
+    await asyncio.to_thread(commit_jobs.enqueue_undo, tenant.tenant_id, update.effective_chat.id,
+                            status_msg.message_id)
+    notify_workers()
+
+
+# --- 3. MAIN APP SETUP ---
+def build_application(latency, request=None):
+    """
+    The bot's Application with all handlers and jobs registered, not yet started.
+    main() runs it; the benchmarks drive it against local stand-ins of the APIs.
+    request - a telegram.request.BaseRequest for the bot's API calls (default: HTTP to Telegram).
+    """
+    builder = (
+        Application.builder()
+        .token(cfg.TELEGRAM_BOT_TOKEN)
+        .persistence(SQLitePersistence(cfg.PERSISTENCE_FILE))
+        .update_queue(StampedQueue(latency))
+        # Independent users in parallel, each user's updates in order
+        .concurrent_updates(PerChatUpdateProcessor(cfg.CONCURRENT_UPDATES))
+        # Every Bot API call - handlers, commit results, reminders - is paced and retried here
+        .rate_limiter(TelegramRateLimiter())
+        .post_shutdown(close_stores)
+    )
+    if cfg.TELEGRAM_API_URL:
+        builder = builder.base_url(f"{cfg.TELEGRAM_API_URL}/bot")
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+
+    startup_timer.mark("build application")
+
+    # Runs before the conversation (group -1) and only records how long the update waited
+    app.add_handler(TypeHandler(Update, latency.on_update), group=-1)
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -294,26 +375,63 @@ def main():
             cfg.STATE_DATE_ALON: [CallbackQueryHandler(handle_date_alon_step, pattern=f"^{cfg.PREFIX_DATE_ALON}")],
             cfg.STATE_KIMEL: [CallbackQueryHandler(handle_kimel_step, pattern=f"^{cfg.PREFIX_KIMEL}")],
 
-            cfg.STATE_CONFIRM: [CallbackQueryHandler(handle_final_confirmation)]
+            # Non-blocking: the commit runs as a task while the application keeps processing other updates
+            cfg.STATE_CONFIRM: [CallbackQueryHandler(handle_final_confirmation, block=False)]
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
+        # Conversation state survives restarts
+        name="planning",
+        persistent=True
     )
 
     app.add_handler(conv_handler)
+    app.add_handler(CommandHandler("undo", undo))
 
     app.job_queue.run_daily(
         thursday_push,
-        time=datetime.time(hour=10, minute=0),
+        time=datetime.time(hour=10, minute=0, tzinfo=cfg.TIME_ZONE),  # Israel time, not the server's
         days=(4,)  # 0=Mon ... 3=Thu
     )
 
-    app.job_queue.run_once(
-        thursday_push,
-        when=60
+    # Logs the startup report once the application is running, then warms up the Google stack
+    app.job_queue.run_once(report_startup, when=0)
+
+    # Drain the commit queue - including jobs interrupted by a restart
+    app.job_queue.run_once(start_commit_workers, when=0)
+
+    # Keep the Calendar OAuth token fresh so confirmations don't have to refresh it
+    app.job_queue.run_repeating(
+        refresh_calendar_token,
+        interval=cfg.TOKEN_REFRESH_CHECK_INTERVAL,
+        first=10
     )
 
+    # Keep the local calendar mirrors current (incremental syncs)
+    if cfg.CALENDAR_BACKEND == "google":
+        app.job_queue.run_repeating(
+            sync_calendar_mirrors,
+            interval=cfg.MIRROR_SYNC_INTERVAL,
+            first=15
+        )
+
+    return app
+
+
+def main():
+    if not cfg.TELEGRAM_BOT_TOKEN:
+        print("Error: Token is missing!")
+        return
+
+    latency = UpdateLatency()
+    app = build_application(latency)
+
+    if cfg.BOT_MODE == "webhook":
+        asyncio.run(run_webhook(app, latency))
+        return
+
     print("Bot is running...")
     app.run_polling()
+    logger.info(f"Update latency: {latency.summary()}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Tuple
+import config as cfg
+from event_plan import DEFAULT_PROFILE, HouseholdProfile, make_slot_templates
+
+logger = logging.getLogger(__name__)
+
+# --- Households (tenants) ---
+# One bot process serves any number of households. Each one has its own calendar,
+# members, names, slot times/titles and Kimel counter. Households are read from
+# cfg.TENANTS_FILE; without that file the bot serves the single household configured
+# by the environment (CALENDAR_ID, ADMIN_CHAT_ID), exactly as before.
+
+DEFAULT_TENANT_ID = "default"
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """A household: where its events go, who may plan for it, and how its events look."""
+    tenant_id: str
+    calendar_id: str
+    members: Tuple[int, ...]
+    profile: HouseholdProfile = DEFAULT_PROFILE
+    token_file: str = cfg.TOKEN_FILE
+    # Chats that get the weekly reminder (by default every member's private chat)
+    notify_chat_ids: Tuple[int, ...] = ()
+
+    @property
+    def reminder_chats(self):
+        return self.notify_chat_ids or self.members
+
+
+class TenantRegistry:
+    """Tenants by ID and by member user ID (a dictionary lookup per update)."""
+
+    def __init__(self, tenants):
+        self._by_id = {}
+        self._by_user = {}
+        for tenant in tenants:
+            if tenant.tenant_id in self._by_id:
+                raise ValueError(f"Duplicate tenant ID: {tenant.tenant_id}")
+            self._by_id[tenant.tenant_id] = tenant
+            for user_id in tenant.members:
+                other = self._by_user.setdefault(user_id, tenant)
+                if other is not tenant:
+                    raise ValueError(f"User {user_id} is a member of both {other.tenant_id} and {tenant.tenant_id}")
+
+    def for_user(self, user_id):
+        """The user's tenant, or None if the user is not a member of any household."""
+        return self._by_user.get(user_id)
+
+    def get(self, tenant_id):
+        return self._by_id.get(tenant_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+def _tenant_from_dict(data):
+    """
+    One household from the tenants file, e.g.
+    {"id": "cohen", "calendar_id": "...@group.calendar.google.com", "members": [123, 456],
+     "names": ["דנה", "יוסי"], "children": "נועה", "kindergarten_child": "נועה",
+     "times": {"morning": ["07:45:00", "08:15:00"]}, "titles": {"kimel": "🧸 גן - יום {number}"},
+     "kimel": {"initial": 1, "max": 20, "reset": 1}, "token_file": "token.json", "notify": [123]}
+    Everything except id, calendar_id and members is optional.
+    """
+    parent_a, parent_b = data.get('names', (DEFAULT_PROFILE.parent_a, DEFAULT_PROFILE.parent_b))
+    kimel = data.get('kimel', {})
+    profile = HouseholdProfile(
+        parent_a=parent_a,
+        parent_b=parent_b,
+        children=data.get('children', DEFAULT_PROFILE.children),
+        kindergarten_child=data.get('kindergarten_child', DEFAULT_PROFILE.kindergarten_child),
+        templates=make_slot_templates(data.get('times'), data.get('titles')),
+        kimel_initial=kimel.get('initial', cfg.KIMEL_INITIAL_COUNT),
+        kimel_max=kimel.get('max', cfg.KIMEL_MAX_COUNT),
+        kimel_reset=kimel.get('reset', cfg.KIMEL_RESET_COUNT),
+    )
+    return Tenant(
+        tenant_id=str(data['id']),
+        calendar_id=data['calendar_id'],
+        members=tuple(int(m) for m in data['members']),
+        profile=profile,
+        token_file=data.get('token_file', cfg.TOKEN_FILE),
+        notify_chat_ids=tuple(int(c) for c in data.get('notify', ())),
+    )
+
+
+def load_tenants(path=cfg.TENANTS_FILE):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            registry = TenantRegistry(_tenant_from_dict(d) for d in json.load(f))
+        logger.info(f"Loaded {len(registry)} households from {path}")
+        return registry
+
+    return TenantRegistry([Tenant(DEFAULT_TENANT_ID, cfg.CALENDAR_ID, tuple(cfg.AUTHORIZED_USER_IDS))])
+
+
+tenants = load_tenants()
+
+
+def tenant_state(bot_data, tenant):
+    """
+    The tenant's own part of bot_data (Kimel counter and per-week counter starts).
+    The counters of a single-household install, kept at the top of bot_data before
+    households existed, move to the default tenant on first use.
+    """
+    all_states = bot_data.setdefault('tenants', {})
+    state = all_states.get(tenant.tenant_id)
+    if state is None:
+        state = all_states[tenant.tenant_id] = {}
+        if tenant.tenant_id == DEFAULT_TENANT_ID:
+            for key in (cfg.KIMEL_COUNTER_KEY, cfg.KIMEL_WEEK_START_KEY):
+                if key in bot_data:
+                    state[key] = bot_data.pop(key)
+        state.setdefault(cfg.KIMEL_COUNTER_KEY, tenant.profile.kimel_initial)
+    return state
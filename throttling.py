@@ -0,0 +1,252 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import logging
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+import config as cfg
+
+logger = logging.getLogger(__name__)
+
+# --- Shared throttling layer for the Google and Telegram APIs ---
+# One token bucket per API paces outgoing requests, transient errors (rate limits, 5xx,
+# network) are retried with exponential backoff + jitter that honours Retry-After,
+# and permanent errors are raised right away. Every retry is counted in RetryStats.
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    `rate` tokens are added per second, up to `capacity`.
+    acquire(n) blocks until n tokens are available, which paces callers to `rate` per second
+    while still allowing a burst of `capacity`. acquire_async(n) does the same without
+    blocking the event loop.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # total seconds callers spent waiting for tokens
+
+    def _take(self, n):
+        """Takes n tokens if available. Returns 0, or the seconds to wait before trying again."""
+        n = min(n, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0
+            wait = (n - self._tokens) / self.rate
+            self.waited += wait
+            return wait
+
+    def acquire(self, n=1):
+        while True:
+            wait = self._take(n)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, n=1):
+        while True:
+            wait = self._take(n)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class RetryStats:
+    """Counters of one API: requests, retries, and errors by kind."""
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.retries = 0
+        self.transient_errors = 0
+        self.permanent_errors = 0
+        self.backoff_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'transient_errors': self.transient_errors,
+            'permanent_errors': self.permanent_errors,
+            'backoff_seconds': round(self.backoff_seconds, 2),
+        }
+
+
+google_bucket = TokenBucket(rate=cfg.CALENDAR_QPS, capacity=cfg.CALENDAR_BATCH_SIZE)
+telegram_bucket = TokenBucket(rate=cfg.TELEGRAM_RPS, capacity=cfg.TELEGRAM_RPS)
+
+google_stats = RetryStats("google")
+telegram_stats = RetryStats("telegram")
+
+# Google's quota belongs to the OAuth account, so buckets are per token file:
+# households sharing a token share one bucket, a household with its own token gets its own.
+_google_buckets = {cfg.TOKEN_FILE: google_bucket}
+_google_buckets_lock = threading.Lock()
+
+
+def google_bucket_for(token_file):
+    """The Google bucket of an OAuth token (same rate and burst as google_bucket)."""
+    with _google_buckets_lock:
+        bucket = _google_buckets.get(token_file)
+        if bucket is None:
+            bucket = _google_buckets[token_file] = TokenBucket(rate=cfg.CALENDAR_QPS, capacity=cfg.CALENDAR_BATCH_SIZE)
+        return bucket
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Exponential backoff with full jitter for retry number `attempt` (0-based).
+    A server-provided Retry-After is a floor - we never retry earlier than asked.
+    """
+    delay = random.uniform(0, min(cfg.RETRY_MAX_DELAY, cfg.RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# --- Google ---
+
+TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'}
+
+
+def google_error_status(exc):
+    """HTTP status of a googleapiclient HttpError (None for other exceptions)."""
+    resp = getattr(exc, 'resp', None)
+    status = getattr(resp, 'status', None)
+    return int(status) if status is not None else None
+
+
+def _google_error_reasons(exc):
+    try:
+        content = json.loads(exc.content.decode('utf-8'))
+        return {e.get('reason') for e in content.get('error', {}).get('errors', [])}
+    except (AttributeError, ValueError):
+        return set()
+
+
+def is_transient_google_error(exc):
+    status = google_error_status(exc)
+    if status is None:
+        # No HTTP response at all: connection reset, timeout, DNS...
+        return isinstance(exc, (OSError, TimeoutError))
+    if status in TRANSIENT_HTTP_STATUSES:
+        return True
+    # The Calendar API reports some rate limits as 403
+    return status == 403 and bool(_google_error_reasons(exc) & RATE_LIMIT_REASONS)
+
+
+def google_retry_after(exc):
+    resp = getattr(exc, 'resp', None)
+    try:
+        return float(resp.get('retry-after')) if resp is not None and resp.get('retry-after') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_google(request, tokens=1, bucket=google_bucket):
+    """
+    Executes a googleapiclient request (blocking) through a Google bucket,
+    retrying transient errors up to cfg.RETRY_MAX_ATTEMPTS times.
+    """
+    attempt = 0
+    while True:
+        bucket.acquire(tokens)
+        google_stats.add(requests=1)
+        try:
+            return request.execute()
+        except Exception as e:
+            if not is_transient_google_error(e):
+                google_stats.add(permanent_errors=1)
+                raise
+            google_stats.add(transient_errors=1)
+            if attempt + 1 >= cfg.RETRY_MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt, google_retry_after(e))
+            logger.warning(f"Google request failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+            google_stats.add(retries=1, backoff_seconds=delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+# --- Telegram ---
+
+def _telegram_retry_after(exc):
+    retry_after = exc.retry_after
+    # Seconds (int) in python-telegram-bot 21, a timedelta in later versions
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+async def call_telegram(make_call):
+    """
+    Runs a Telegram API call through the Telegram bucket.
+    `make_call` is a zero-argument function returning a new coroutine (so it can be retried).
+    Flood control (RetryAfter) and network errors / timeouts are retried with backoff;
+    "message is not modified" is not an error for us and returns None;
+    any other error is raised.
+    """
+    attempt = 0
+    while True:
+        await telegram_bucket.acquire_async()
+        telegram_stats.add(requests=1)
+        try:
+            return await make_call()
+        except RetryAfter as e:
+            error, retry_after = e, _telegram_retry_after(e)
+        except BadRequest as e:
+            if "not modified" in e.message.lower():
+                return None
+            telegram_stats.add(permanent_errors=1)
+            raise
+        except NetworkError as e:  # includes TimedOut
+            error, retry_after = e, None
+        except TelegramError:
+            telegram_stats.add(permanent_errors=1)
+            raise
+
+        telegram_stats.add(transient_errors=1)
+        if attempt + 1 >= cfg.RETRY_MAX_ATTEMPTS:
+            raise error
+        delay = backoff_delay(attempt, retry_after)
+        logger.warning(f"Telegram request failed ({error}), retry {attempt + 1} in {delay:.1f}s")
+        telegram_stats.add(retries=1, backoff_seconds=delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Sends every Bot API call of the application through call_telegram, so the wizard's
+    messages and edits, the commit results and the reminders all share the Telegram bucket
+    and the RetryAfter / network backoff. Plugged in once with ApplicationBuilder().rate_limiter();
+    the bot is then called directly everywhere. getUpdates is left alone - the updater
+    retries its long polls itself.
+    """
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == 'getUpdates':
+            return await callback(*args, **kwargs)
+        return await call_telegram(lambda: callback(*args, **kwargs))
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from latency_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates at once, but never two updates of the
+    same user (or, for updates without a user, the same chat) at the same time - so every
+    conversation state change and WeeklySchedule toggle of one user stays in order while
+    other users proceed in parallel.
+
+    Note that an update waiting for its user's lock already holds one of the concurrency slots.
+    Lock waits are recorded: stats() returns how many updates waited and for how long.
+    """
+
+    def __init__(self, max_concurrent_updates, max_samples=1000):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # key -> [asyncio.Lock, number of updates holding or waiting for it]
+        self._waits = deque(maxlen=max_samples)
+        self.processed = 0
+        self.contended = 0  # updates that had to wait for another update of the same key
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return 'user', update.effective_user.id
+        if update.effective_chat:
+            return 'chat', update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+        started = time.perf_counter()
+        if lock.locked():
+            self.contended += 1
+        try:
+            async with lock:
+                self._waits.append((time.perf_counter() - started) * 1000)
+                self.processed += 1
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def stats(self):
+        return {
+            'max_concurrent_updates': self.max_concurrent_updates,
+            'in_progress': self.current_concurrent_updates,
+            'processed': self.processed,
+            'contended': self.contended,
+            'lock_wait_p50_ms': round(percentile(self._waits, 0.5, 0), 3),
+            'lock_wait_p99_ms': round(percentile(self._waits, 0.99, 0), 3),
+            'lock_wait_max_ms': round(max(self._waits, default=0), 3),
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        logger.info(f"Update processor: {self.stats()}")
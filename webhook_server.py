@@ -0,0 +1,245 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import time
+from collections import deque
+from telegram import Update
+import config as cfg
+from latency_stats import percentile
+from startup import startup_timer
+from commit_queue import commit_jobs
+from calendar_mirror import calendar_mirror
+
+logger = logging.getLogger(__name__)
+
+# --- Webhook serving mode ---
+# A small HTTP server (stdlib asyncio streams, no extra dependency) that receives updates
+# from Telegram, verifies the secret token and feeds them to the Application's update
+# queue. GET cfg.HEALTH_PATH returns status and latency numbers as JSON.
+
+
+class UpdateLatency:
+    """
+    Measures how long updates wait before a handler sees them, in both serving modes:
+    queue_to_handler - from entering the application's update queue to the first handler (ms),
+    receive_to_handler - webhook only: from the HTTP request line arriving to the first handler (ms).
+    """
+
+    def __init__(self, max_samples=1000):
+        self._queued = {}
+        self._received = {}
+        self.queue_to_handler = deque(maxlen=max_samples)
+        self.receive_to_handler = deque(maxlen=max_samples)
+        self.updates = 0
+
+    def received(self, update_id, at):
+        self._received[update_id] = at
+
+    def queued(self, update_id):
+        self._queued[update_id] = time.perf_counter()
+
+    async def on_update(self, update: Update, context):
+        """TypeHandler callback, registered in a group before the conversation."""
+        now = time.perf_counter()
+        self.updates += 1
+        queued = self._queued.pop(update.update_id, None)
+        if queued is not None:
+            self.queue_to_handler.append((now - queued) * 1000)
+        received = self._received.pop(update.update_id, None)
+        if received is not None:
+            self.receive_to_handler.append((now - received) * 1000)
+
+    @staticmethod
+    def _percentiles(samples):
+        if not samples:
+            return None
+        return {'count': len(samples), 'p50_ms': round(percentile(samples, 0.5), 3),
+                'p99_ms': round(percentile(samples, 0.99), 3), 'max_ms': round(max(samples), 3)}
+
+    def summary(self):
+        return {
+            'updates': self.updates,
+            'queue_to_handler': self._percentiles(self.queue_to_handler),
+            'receive_to_handler': self._percentiles(self.receive_to_handler),
+        }
+
+
+class StampedQueue(asyncio.Queue):
+    """Update queue that records when each update entered it (polling and webhook alike)."""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def put_nowait(self, item):
+        if isinstance(item, Update):
+            self.latency.queued(item.update_id)
+        super().put_nowait(item)
+
+
+class WebhookServer:
+    """
+    Minimal HTTP/1.1 server for Telegram webhooks.
+    POST cfg.WEBHOOK_PATH - an update (requires the X-Telegram-Bot-Api-Secret-Token header
+    when cfg.WEBHOOK_SECRET is set); GET cfg.HEALTH_PATH - health and latency as JSON.
+    """
+
+    def __init__(self, app, latency, host=cfg.WEBHOOK_LISTEN, port=cfg.WEBHOOK_PORT):
+        self.app = app
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.started = time.monotonic()
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{cfg.WEBHOOK_PATH}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                received_at = time.perf_counter()
+                method, path, _version = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length, rejection = self._check_headers(method, path, headers)
+                if rejection:
+                    # The body is never read, so the connection can't be reused
+                    status, payload = rejection
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self._handle(method, path, headers, body, received_at)
+                    except Exception:
+                        logger.exception(f"Webhook request {method} {path} failed")
+                        status, payload = "500 Internal Server Error", {'ok': False}
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.debug(f"Webhook connection closed: {e}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _secret_ok(headers):
+        if not cfg.WEBHOOK_SECRET:
+            return True
+        received = headers.get('x-telegram-bot-api-secret-token', '')
+        return hmac.compare_digest(received.encode(), cfg.WEBHOOK_SECRET.encode())
+
+    def _check_headers(self, method, path, headers):
+        """
+        Checks a request by its headers, before any of its body is read - an unauthenticated
+        client can't make the server wait for or buffer a body.
+        Returns (content length, None) or (None, (status, payload)) for a rejected request.
+        """
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return None, ("400 Bad Request", {'ok': False})
+        if length < 0:
+            return None, ("400 Bad Request", {'ok': False})
+        if method == 'POST' and path.split('?', 1)[0] == cfg.WEBHOOK_PATH and not self._secret_ok(headers):
+            self.rejected += 1
+            return None, ("403 Forbidden", {'ok': False})
+        if length > cfg.WEBHOOK_MAX_BODY:
+            return None, ("413 Payload Too Large", {'ok': False})
+        return length, None
+
+    async def _handle(self, method, path, headers, body, received_at):
+        path = path.split('?', 1)[0]
+
+        if method == 'GET' and path == cfg.HEALTH_PATH:
+            return "200 OK", {
+                'status': 'ok' if self.app.running else 'stopped',
+                'mode': 'webhook',
+                'uptime_s': round(time.monotonic() - self.started, 1),
+                'pending_updates': self.app.update_queue.qsize(),
+                'rejected': self.rejected,
+                'latency': self.latency.summary(),
+                'processor': getattr(self.app.update_processor, 'stats', dict)(),
+                'commit_queue': await asyncio.to_thread(commit_jobs.stats),
+                'calendar_mirror': await asyncio.to_thread(calendar_mirror.stats),
+                'startup': startup_timer.as_dict(),
+            }
+
+        if method != 'POST' or path != cfg.WEBHOOK_PATH:
+            return "404 Not Found", {'ok': False}
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+            if update is None:
+                raise ValueError("empty update")
+        except (ValueError, TypeError, AttributeError, KeyError):
+            return "400 Bad Request", {'ok': False}
+
+        self.latency.received(update.update_id, received_at)
+        await self.app.update_queue.put(update)
+        return "200 OK", {'ok': True}
+
+
+async def run_webhook(app, latency):
+    """
+    Runs the application in webhook mode until SIGINT/SIGTERM.
+    The webhook is registered with Telegram only when cfg.WEBHOOK_URL is set -
+    without it the server just listens (local testing with fake_telegram_sender.py).
+    A public webhook must have a secret: the user ID in an update is the only authorization
+    the bot has, so without one anyone who can reach the port could act as a household member.
+    """
+    if cfg.WEBHOOK_URL and not cfg.WEBHOOK_SECRET:
+        logger.error("WEBHOOK_URL is set but WEBHOOK_SECRET is empty - refusing to start in webhook mode")
+        return
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    server = WebhookServer(app, latency)
+    async with app:
+        await app.start()
+        await server.start()
+        if cfg.WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=cfg.WEBHOOK_URL + cfg.WEBHOOK_PATH,
+                secret_token=cfg.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        print("Bot is running (webhook)...")
+        await stop.wait()
+        await server.stop()
+        await app.stop()
+    # Like run_polling, which calls it itself
+    if app.post_shutdown:
+        await app.post_shutdown(app)